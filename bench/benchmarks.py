@@ -0,0 +1,295 @@
+''' The benchmarks.
+
+    Each benchmark is a function decorated with @benchmark that prepares
+    whatever it needs and returns the function to time (without
+    arguments). The preparation is not timed.
+
+    If the benchmark uses a FakeDriver, it returns the driver too so
+    the runner can count the round trips of each call.
+    '''
+import os
+import re
+import tempfile
+
+import selectq
+from selectq import Selector, FileBrowser, WebBrowser
+from selectq.browsers import DocumentCache
+
+from fakedriver import FakeDriver
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DASHBOARD = os.path.join(HERE, '..', 'test', 'ds', 'dashboard.html')
+
+# simulated latency of a round trip to the driver (seconds)
+LATENCY = 0.001
+
+benchmarks = {}
+
+
+def benchmark(name):
+    def decorator(fn):
+        benchmarks[name] = fn
+        return fn
+
+    return decorator
+
+
+_tmpdir = None
+
+
+def scaled_dashboard(times):
+    ''' Return the path to a copy of test/ds/dashboard.html with the
+        content of its body repeated <times> times.
+        '''
+    global _tmpdir
+    if _tmpdir is None:
+        _tmpdir = tempfile.TemporaryDirectory(prefix='selectq-bench-')
+
+    path = os.path.join(_tmpdir.name, 'dashboard-x{}.html'.format(times))
+    if os.path.exists(path):
+        return path
+
+    with open(DASHBOARD, 'rt', encoding='utf-8') as f:
+        html = f.read()
+
+    m = re.search(r'(?s)(<body[^>]*>)(.*)(</body>)', html)
+    body = m.group(2)
+    html = html[:m.start(2)] + body * times + html[m.end(2):]
+
+    with open(path, 'wt', encoding='utf-8') as f:
+        f.write(html)
+
+    return path
+
+
+# Selections: building and rendering
+# ==================================
+
+
+@benchmark('selection/build-chain')
+def _():
+    sQ = Selector()
+
+    def run():
+        sQ.select('div', class_='container').select(
+            'table', class_='table'
+        ).select('tr').children('td').at(1).select('a', href=None).xpath
+
+    return run
+
+
+@benchmark('selection/build-union')
+def _():
+    sQ = Selector()
+
+    def run():
+        links = sQ.select('ul', class_='nav').select('a')
+        (links | sQ.select('h1')
+         | sQ.select('h2', class_='sub-header')).select('span').parent().xpath
+
+    return run
+
+
+@benchmark('selection/render-verbatim')
+def _():
+    sQ = Selector()
+
+    def run():
+        str(sQ.select('li').select('a').siblings().at(0).that('span'))
+
+    return run
+
+
+# FileBrowser: parsing and querying
+# =================================
+
+
+def _filebrowser_benchmarks(times):
+    @benchmark('filebrowser/parse-x{}'.format(times))
+    def _():
+        path = scaled_dashboard(times)
+        browser = FileBrowser(document_cache=DocumentCache(max_bytes=0))
+
+        def run():
+            browser.get(path)
+
+        return run
+
+    def query(sel):
+        def run():
+            sel.count()
+            sel.text()
+
+        return run
+
+    @benchmark('filebrowser/select-class-x{}'.format(times))
+    def _():
+        sQ = Selector(FileBrowser(indexes=False))
+        sQ.browser.get(scaled_dashboard(times))
+        return query(sQ.select('h2', class_='sub-header'))
+
+    @benchmark('filebrowser/select-class-x{}-indexed'.format(times))
+    def _():
+        sQ = Selector(FileBrowser(indexes=True))
+        sQ.browser.get(scaled_dashboard(times))
+        return query(sQ.select('h2', class_='sub-header'))
+
+    @benchmark('filebrowser/select-nested-x{}'.format(times))
+    def _():
+        sQ = Selector(FileBrowser())
+        sQ.browser.get(scaled_dashboard(times))
+        return query(sQ.select('table').select('tr').children('td').at(2))
+
+
+for _times in (1, 10, 100):
+    _filebrowser_benchmarks(_times)
+
+
+@benchmark('filebrowser/table-x10')
+def _():
+    sQ = Selector(FileBrowser())
+    sQ.browser.get(scaled_dashboard(10))
+    tbl = sQ.select('table')[0]
+
+    def run():
+        tbl.table()
+
+    return run
+
+
+# WebBrowser: round trips against a fake driver
+# =============================================
+
+
+def _web(times=1):
+    driver = FakeDriver(scaled_dashboard(times), latency=LATENCY)
+
+    # the fake driver evaluates xpaths only: there is no DOM for
+    # the CSS selectors
+    sQ = Selector(WebBrowser(driver, css=False))
+    sQ.count()  # load the gadgets
+    return sQ, driver
+
+
+@benchmark('webbrowser/count')
+def _():
+    sQ, driver = _web()
+    sel = sQ.select('li')
+
+    def run():
+        sel.count()
+
+    return run, driver
+
+
+@benchmark('webbrowser/pluck-x10')
+def _():
+    sQ, driver = _web(10)
+    sel = sQ.select('td')
+
+    def run():
+        sel.pluck('textContent', 'className')
+
+    return run, driver
+
+
+@benchmark('webbrowser/pluck-columns-x10')
+def _():
+    sQ, driver = _web(10)
+    sel = sQ.select('td')
+
+    def run():
+        sel.pluck_columns('textContent', 'className')
+
+    return run, driver
+
+
+@benchmark('webbrowser/iter-pluck-x10')
+def _():
+    sQ, driver = _web(10)
+    sel = sQ.select('td')
+
+    def run():
+        for batch in sel.iter_pluck(
+            'textContent', 'className', batch_size=500
+        ):
+            pass
+
+    return run, driver
+
+
+@benchmark('webbrowser/batch-3-reads')
+def _():
+    sQ, driver = _web()
+    tbl = sQ.select('table')
+
+    def run():
+        with sQ.browser.batch():
+            a = tbl.select('th').text()
+            b = tbl.select('td').text()
+            c = tbl.count()
+        a.value, b.value, c.value
+
+    return run, driver
+
+
+@benchmark('webbrowser/snapshot-3-reads')
+def _():
+    sQ, driver = _web()
+    tbl = sQ.select('table')
+
+    def run():
+        with sQ.browser.snapshot():
+            tbl.select('th').text()
+            tbl.select('td').text()
+            tbl.count()
+
+    return run, driver
+
+
+@benchmark('webbrowser/cached-3-reads')
+def _():
+    sQ, driver = _web()
+    tbl = sQ.select('table')
+
+    def run():
+        with sQ.browser.cached():
+            for _ in range(2):
+                tbl.select('th').text()
+                tbl.select('td').text()
+                tbl.count()
+
+    return run, driver
+
+
+@benchmark('webbrowser/wait-for-polling')
+def _():
+    sQ, driver = _web()
+    sel = sQ.select('li')
+
+    def run():
+        selectq.wait_for(sel >= 1)
+
+    return run, driver
+
+
+@benchmark('webbrowser/wait-for-3-conds')
+def _():
+    sQ, driver = _web()
+    li, tbl, blink = sQ.select('li'), sQ.select('table'), sQ.select('blink')
+
+    def run():
+        selectq.wait_for(li >= 1, tbl == 1, blink == 0)
+
+    return run, driver
+
+
+@benchmark('webbrowser/wait-for-observe')
+def _():
+    sQ, driver = _web()
+    sel = sQ.select('li')
+
+    def run():
+        selectq.wait_for(sel >= 1, observe=True)
+
+    return run, driver
@@ -0,0 +1,229 @@
+''' A fake Selenium's WebDriver for the benchmarks.
+
+    The scripts of the gadgets' runtime (selectq.run, selectq.run_batch,
+    selectq.run_cached and selectq.wait_for_all) are answered evaluating the xpaths with a
+    FileBrowser so the results are real but no browser is needed.
+
+    Each command sleeps <latency> seconds to simulate the round trip
+    to the driver and it is counted, with the bytes sent and received,
+    so the benchmarks can track how many round trips an operation
+    takes. The commands are answered by execute(), the method that
+    RemoteWebDriver and its WebElements call for every command, so
+    none goes uncounted.
+
+    The elements found (find_elements()) can be clicked, cleared and
+    typed into: the interactions are logged. If <rerender_on_click> is
+    True, a click re-renders the page so the elements found before are
+    stale, like in a page that redraws itself.
+    '''
+import collections
+import json
+import time
+
+from lxml import etree
+from selenium.common.exceptions import (
+    StaleElementReferenceException, WebDriverException
+)
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.locator_converter import LocatorConverter
+from selenium.webdriver.remote.webelement import WebElement
+
+from selectq.browsers import (
+    FileBrowser, RemoteWebDriver, _run_script, _run_batch_script,
+    _run_cached_script, _wait_all_script, _outer_html_script, _property_getter
+)
+
+
+class FakeDriver(RemoteWebDriver):
+    def __init__(self, path, latency=0.001):
+        # do not call RemoteWebDriver.__init__: there is no driver
+        self.page = FileBrowser()
+        self.page.get(path)
+        self.latency = latency
+        self.cursors = {}
+        self.script_timeout = 30
+        self.rerender_on_click = False
+        self.renders = 0
+        self.elements = {}
+        self.locator_converter = LocatorConverter()
+        self.session_id = 'fake'
+        self._is_remote = False
+        self.reset()
+
+    def reset(self):
+        self.calls = collections.Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.interactions = []
+
+    @property
+    def round_trips(self):
+        return sum(self.calls.values())
+
+    def execute(self, driver_command, params=None):
+        params = params or {}
+        self.calls[driver_command] += 1
+        self.bytes_sent += len(json.dumps(params, default=str))
+        if self.latency:
+            time.sleep(self.latency)
+
+        handler = _handlers.get(driver_command)
+        if handler is None:
+            raise WebDriverException(
+                "Unsupported command '{}'.".format(driver_command)
+            )
+
+        result = getattr(self, handler)(params)
+        self.bytes_received += len(json.dumps(result, default=str))
+        return {'value': result}
+
+    def _execute_script(self, params):
+        script, args = params['script'], params['args']
+        if script.endswith(_run_batch_script):
+            result = [self._try_run(*request) for request in args[0]]
+        elif script.endswith(_run_cached_script):
+            # the document never changes: its version neither
+            version, request = args[0], args[1:]
+            if version == _version:
+                result = [_version, True, None]
+            else:
+                result = [_version, False, self._run(*request)]
+        elif script.endswith(_run_script):
+            result = self._run(*args)
+        elif script.endswith(_outer_html_script):
+            result = etree.tostring(
+                self.page.tree, method='html', encoding='unicode'
+            )
+        else:
+            result = None  # loading the gadgets, for example
+
+        return result
+
+    def _execute_async_script(self, params):
+        script, args = params['script'], params['args']
+        if not script.endswith(_wait_all_script):
+            return None
+
+        # the document never changes: the conditions hold now or never
+        return [
+            _comparators[sym](self.page.count(xpath), cnt)
+            for xpath, sym, cnt in args[0]
+        ]
+
+    def _get_timeouts(self, params):
+        return {
+            'implicit': 0,
+            'pageLoad': 300000,
+            'script': int(self.script_timeout * 1000)
+        }
+
+    def _set_timeouts(self, params):
+        if 'script' in params:
+            self.script_timeout = params['script'] / 1000
+        return None
+
+    def _find_elements(self, params):
+        if params['using'] != 'xpath':
+            raise WebDriverException(
+                "Unsupported locator '{}'.".format(params['using'])
+            )
+
+        found = []
+        for el in self.page.iter_elements(params['value']):
+            id = '{}-{}'.format(self.renders, len(self.elements))
+            self.elements[id] = el
+            found.append(WebElement(self, id))
+        return found
+
+    def _click(self, params):
+        self._interact('click', params)
+        if self.rerender_on_click:
+            self.renders += 1
+
+    def _clear(self, params):
+        self._interact('clear', params)
+
+    def _send_keys(self, params):
+        self._interact('send_keys', params)
+
+    def _interact(self, action, params):
+        ''' Log the <action> on the element of the <params> (its text)
+            unless the element is stale.
+            '''
+        id = params['id']
+        if not id.startswith('{}-'.format(self.renders)):
+            raise StaleElementReferenceException('stale element reference')
+
+        el = self.elements[id]
+        self.interactions.append((action, ''.join(el.itertext())))
+
+    def execute_cdp_cmd(self, cmd, params):
+        raise Exception("Not supported")
+
+    def quit(self):
+        pass
+
+    def _run(self, kind, xpath, args=None):
+        page = self.page
+        if kind == 'count':
+            return page.count(xpath)
+        if kind == 'pluck':
+            return page.pluck(xpath, args)
+        if kind == 'pluck_columns':
+            return json.dumps(page.pluck_columns(xpath, args))
+        if kind == 'table_cells':
+            return json.dumps(page.table_cells(xpath))
+        if kind == 'open_cursor':
+            cursor = len(self.cursors) + 1
+            self.cursors[cursor] = list(page.iter_elements(xpath))
+            return [cursor, len(self.cursors[cursor])]
+        if kind in ('fetch_rows', 'fetch_columns'):
+            cursor, properties, start, size = args
+            getters = [_property_getter(prop) for prop in properties]
+            rows = [
+                [get(el) for get in getters]
+                for el in self.cursors[cursor][start:start + size]
+            ]
+            if kind == 'fetch_rows':
+                return rows
+            return json.dumps(
+                {
+                    prop: [row[i] for row in rows]
+                    for i, prop in enumerate(properties)
+                }
+            )
+        if kind == 'close_cursor':
+            del self.cursors[args]
+            return None
+
+        raise Exception("Unsupported operation '{}'.".format(kind))
+
+    def _try_run(self, kind, xpath, args=None):
+        try:
+            return [True, self._run(kind, xpath, args)]
+        except Exception as err:
+            return [False, str(err)]
+
+
+# the method of FakeDriver that answers each command
+_handlers = {
+    Command.W3C_EXECUTE_SCRIPT: '_execute_script',
+    Command.W3C_EXECUTE_SCRIPT_ASYNC: '_execute_async_script',
+    Command.GET_TIMEOUTS: '_get_timeouts',
+    Command.SET_TIMEOUTS: '_set_timeouts',
+    Command.FIND_ELEMENTS: '_find_elements',
+    Command.CLICK_ELEMENT: '_click',
+    Command.CLEAR_ELEMENT: '_clear',
+    Command.SEND_KEYS_TO_ELEMENT: '_send_keys',
+}
+
+_version = ['fake', 0]
+
+_comparators = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+}
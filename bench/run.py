@@ -0,0 +1,175 @@
+''' Run the benchmarks and compare them against a baseline.
+
+        python bench/run.py                 # run all and compare
+        python bench/run.py webbrowser/     # only the matching ones
+        python bench/run.py --save          # store them as the baseline
+
+    Each benchmark is timed with timeit: the best time per call of
+    several repetitions is taken. The benchmarks against the fake
+    driver count the round trips (commands sent to the driver) of a
+    call too.
+
+    A benchmark regresses if it takes more round trips than the
+    baseline. The exit code is 1 if any benchmark regressed.
+
+    The timings depend on the machine (and on its load) so they are
+    advisory: a benchmark slower than the baseline by more than the
+    tolerance is reported as 'slower' but it is not a regression unless
+    --check-time is given. Save the baseline on the same machine that
+    runs the comparison before checking the timings.
+    '''
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# benchmark the working copy, not an installed selectq
+sys.path.insert(0, os.path.dirname(HERE))
+
+from benchmarks import benchmarks  # noqa: E402
+
+
+def measure(setup, repeat):
+    run = setup()
+    driver = None
+    if isinstance(run, tuple):
+        run, driver = run
+
+    run()  # warm up: load the gadgets, fill the caches, ...
+
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    result = {'time': best}
+    if driver is not None:
+        driver.reset()
+        run()
+        result['round_trips'] = driver.round_trips
+        result['bytes'] = driver.bytes_sent + driver.bytes_received
+
+    return result
+
+
+def compare(result, base, tolerance, check_time=False):
+    ''' Return the status of the <result> against the baseline <base>:
+        'new', 'ok', 'faster', 'slower' or 'REGRESSION'.
+
+        Being slower is a regression only if <check_time> is True.
+        '''
+    if base is None:
+        return 'new'
+
+    if result.get('round_trips', 0) > base.get('round_trips', 0):
+        return 'REGRESSION'
+
+    ratio = result['time'] / base['time']
+    if ratio > 1 + tolerance:
+        return 'REGRESSION' if check_time else 'slower'
+    if ratio < 1 - tolerance:
+        return 'faster'
+    return 'ok'
+
+
+def fmt_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '{:.3g} {}'.format(seconds / scale, unit)
+    return '{:.3g} ns'.format(seconds / 1e-9)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run selectq's benchmarks.")
+    parser.add_argument(
+        'patterns',
+        nargs='*',
+        help='run only the benchmarks whose names match (regex)'
+    )
+    parser.add_argument(
+        '--baseline',
+        default=os.path.join(HERE, 'baseline.json'),
+        help='baseline file (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--save',
+        action='store_true',
+        help='save the results into the baseline file'
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.25,
+        help='allowed slow down ratio (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--check-time',
+        action='store_true',
+        help='fail on timings beyond the tolerance too'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='repetitions of each benchmark (default: %(default)s)'
+    )
+    args = parser.parse_args(argv)
+
+    names = [
+        name for name in benchmarks
+        if not args.patterns or any(re.search(p, name) for p in args.patterns)
+    ]
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'rt') as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = 0
+    print(
+        '{:<40} {:>10} {:>10} {:>7} {:>6}  {}'.format(
+            'benchmark', 'time', 'baseline', 'ratio', 'trips', 'status'
+        )
+    )
+    for name in names:
+        result = measure(benchmarks[name], args.repeat)
+        results[name] = result
+
+        base = baseline.get(name)
+        status = compare(result, base, args.tolerance, args.check_time)
+        regressions += status == 'REGRESSION'
+
+        trips = result.get('round_trips')
+        if trips is not None and base is not None and \
+                trips != base.get('round_trips'):
+            trips = '{}/{}'.format(trips, base.get('round_trips'))
+
+        print(
+            '{:<40} {:>10} {:>10} {:>7} {:>6}  {}'.format(
+                name,
+                fmt_time(result['time']),
+                fmt_time(base['time']) if base else '-',
+                '{:.2f}'.format(result['time'] /
+                                base['time']) if base else '-',
+                '-' if trips is None else trips,
+                status,
+            )
+        )
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'wt') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Baseline saved in {}'.format(args.baseline))
+        return 0
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
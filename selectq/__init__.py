@@ -27,5 +27,9 @@ try:
     from .browsers import FileBrowser, WebBrowser
     from .predicates import Attr, Value, Text
     from .shortcuts import open_browser, wait_for
+    from .pool import BrowserPool
+    from .downloads import Downloader
+    from .bulk import map_files
+    from .aio import AsyncSelector
 except ImportError:
     pass  # this happens when importing from setup.py
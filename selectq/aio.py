@@ -0,0 +1,320 @@
+''' asyncio API for selectq.
+
+    The calls to the browser are blocking (Selenium speaks HTTP with
+    the driver synchronously) so they are executed in a thread, one
+    single thread per browser: the operations on the same browser
+    are executed in order while the event loop is free to coordinate
+    other browsers.
+    '''
+import asyncio
+import concurrent.futures
+import functools
+import weakref
+
+from .browsers import _browser_wrapper
+from .selectq import Selector
+from . import shortcuts
+
+# One executor (a single thread) per browser
+_executors = weakref.WeakKeyDictionary()
+
+# The task that has a batch open on each browser (see AsyncBrowser.batch)
+_batch_tasks = weakref.WeakKeyDictionary()
+
+
+def _executor_for(browser):
+    executor = _executors.get(browser)
+    if executor is None:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        _executors[browser] = executor
+        weakref.finalize(browser, executor.shutdown, wait=False)
+
+    return executor
+
+
+def _check_batch(browser):
+    ''' Raise if another task has a batch open on the <browser>: the
+        batch is state of the browser so the reads of this task would be
+        queued in it.
+        '''
+    task = _batch_tasks.get(browser)
+    if task is not None and task is not asyncio.current_task():
+        raise RuntimeError(
+            'The browser has a batch open in another task: wait for the batch to end before using the browser.'
+        )
+
+
+async def _call(browser, fn, *args, **kargs):
+    ''' Call fn(*args, **kargs) in the executor of the <browser>. '''
+    _check_batch(browser)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        _executor_for(browser), functools.partial(fn, *args, **kargs)
+    )
+
+
+async def _iterate(browser, it):
+    ''' Iterate over the (blocking) iterator <it> in the executor of
+        the <browser>.
+        '''
+    try:
+        while True:
+            item = await _call(browser, next, it, None)
+            if item is None:
+                return
+            yield item
+    finally:
+        # close it in the executor too: closing it may talk with the
+        # browser (the in-page cursor) and it must be done in order
+        # with the rest of the operations
+        await _call(browser, it.close)
+
+
+class _AsyncContextManager:
+    ''' Enter and exit the (blocking) context manager in the executor
+        of the browser.
+        '''
+    def __init__(self, browser, cm, wrap=None):
+        self._browser = browser
+        self._cm = cm
+        self._wrap = wrap
+
+    async def __aenter__(self):
+        obj = await _call(self._browser, self._cm.__enter__)
+        return obj if self._wrap is None else self._wrap(obj)
+
+    async def __aexit__(self, *exc_info):
+        return await _call(self._browser, self._cm.__exit__, *exc_info)
+
+
+class _AsyncBatch(_AsyncContextManager):
+    ''' Like _AsyncContextManager but the batch belongs to the task that
+        entered it (see _check_batch).
+        '''
+    async def __aenter__(self):
+        _check_batch(self._browser)
+        self._outer = _batch_tasks.get(self._browser)
+        _batch_tasks[self._browser] = asyncio.current_task()
+        try:
+            return await super().__aenter__()
+        except BaseException:
+            self._release()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await super().__aexit__(*exc_info)
+        finally:
+            self._release()
+
+    def _release(self):
+        if self._outer is None:
+            del _batch_tasks[self._browser]
+        else:
+            _batch_tasks[self._browser] = self._outer
+
+
+class AsyncBrowser:
+    ''' asyncio facade of a Browser (or of a Selenium's WebDriver).
+        The original browser is available in the 'sync' attribute.
+        '''
+    def __init__(self, browser):
+        self.sync = _browser_wrapper(browser)
+
+    async def get(self, url):
+        return await _call(self.sync, self.sync.get, url)
+
+    async def quit(self):
+        return await _call(self.sync, self.sync.quit)
+
+    async def highlight_off(self):
+        return await _call(self.sync, self.sync.highlight_off)
+
+    def batch(self):
+        ''' Async version of WebBrowser.batch():
+
+                async with sQ.browser.batch():
+                    ips = await first_column.text()
+                    ...
+
+                ips.value
+
+            Note that inside the block the reads are awaited as usual
+            but they only queue the read and return a Pending object:
+            its value is available after the block.
+
+            The batch is open in the browser, not only in this task:
+            while the block is open, the other tasks that use the same
+            browser fail with a RuntimeError instead of having their
+            reads queued in the batch.
+            '''
+        return _AsyncBatch(self.sync, self.sync.batch())
+
+    async def call(self, fn, *args, **kargs):
+        ''' Call fn(*args, **kargs) in the thread of this browser, in
+            order with the rest of the operations on it.
+            '''
+        return await _call(self.sync, fn, *args, **kargs)
+
+
+class AsyncSelection:
+    ''' asyncio facade of a Selection.
+
+        The methods that build new selections (select(), children(),
+        ...) are the same than Selection's and they return AsyncSelections.
+
+        The methods that read from or interact with the browser are
+        coroutines (pluck(), text(), count(), click(), ...)
+        and iter_pluck(), iter_text() and iter_pluck_columns() are async
+        generators.
+        '''
+    def __init__(self, sel, browser):
+        self.sync = sel
+        self.browser = browser
+
+    @property
+    def xpath(self):
+        return self.sync.xpath
+
+    def _wrap(self, sel):
+        return AsyncSelection(sel, self.browser)
+
+    def switched(self):
+        ''' Async version of Selection.switched():
+
+                async with sel.switched():
+                    ...
+            '''
+        return _AsyncContextManager(
+            self.browser.sync, self.sync.switched(), self._wrap
+        )
+
+    async def materialize(self):
+        ''' Async version of Selection.materialize(). '''
+        sel = await _call(self.browser.sync, self.sync.materialize)
+        return self._wrap(sel)
+
+    def iter_pluck(self, *properties, batch_size=500):
+        return _iterate(
+            self.browser.sync,
+            self.sync.iter_pluck(*properties, batch_size=batch_size)
+        )
+
+    def iter_text(self, inner=False, batch_size=500):
+        return _iterate(
+            self.browser.sync,
+            self.sync.iter_text(inner=inner, batch_size=batch_size)
+        )
+
+    def iter_pluck_columns(self, *properties, **kargs):
+        return _iterate(
+            self.browser.sync,
+            self.sync.iter_pluck_columns(*properties, **kargs)
+        )
+
+    def __or__(self, other):
+        if isinstance(other, AsyncSelection):
+            other = other.sync
+        return self._wrap(self.sync | other)
+
+    # The comparisons build conditions for wait_for()
+    def __eq__(self, cnt):
+        return self.sync == cnt
+
+    __hash__ = object.__hash__
+
+    def __ne__(self, cnt):
+        return self.sync != cnt
+
+    def __lt__(self, cnt):
+        return self.sync < cnt
+
+    def __le__(self, cnt):
+        return self.sync <= cnt
+
+    def __gt__(self, cnt):
+        return self.sync > cnt
+
+    def __ge__(self, cnt):
+        return self.sync >= cnt
+
+    def __str__(self):
+        return str(self.sync)
+
+    def __repr__(self):
+        return 'async ' + repr(self.sync)
+
+
+def _building_method(name):
+    def method(self, *args, **kargs):
+        args = [a.sync if isinstance(a, AsyncSelection) else a for a in args]
+        return self._wrap(getattr(self.sync, name)(*args, **kargs))
+
+    method.__name__ = name
+    method.__doc__ = getattr(Selector, name).__doc__
+    return method
+
+
+def _blocking_method(name):
+    async def method(self, *args, **kargs):
+        return await _call(
+            self.browser.sync, getattr(self.sync, name), *args, **kargs
+        )
+
+    method.__name__ = name
+    method.__doc__ = getattr(Selector, name).__doc__
+    return method
+
+
+for _name in (
+    'select', 'children', 'siblings', 'has_children', 'that', 'at', 'query',
+    'parent', 'abs_select', '__getitem__'
+):
+    setattr(AsyncSelection, _name, _building_method(_name))
+
+for _name in (
+    'pluck', 'pluck_columns', 'text', 'html', 'count', 'expects', 'describe',
+    'pprint', 'highlight', 'click', 'send_keys', 'clear', 'set_value', 'fill',
+    'web_elements', 'download', 'table'
+):
+    setattr(AsyncSelection, _name, _blocking_method(_name))
+
+del _name
+
+
+def AsyncSelector(browser):
+    ''' Return a Selector (sQ) bound to the <browser> with an asyncio
+        API (see AsyncSelection).
+        '''
+    browser = AsyncBrowser(browser)
+    return AsyncSelection(Selector(browser.sync), browser)
+
+
+async def open_browser(url, browser_type, **kargs):
+    ''' Async version of selectq.open_browser(): start the browser in
+        a thread and return an AsyncSelector bound to it.
+        '''
+    loop = asyncio.get_event_loop()
+    driver = await loop.run_in_executor(
+        None, functools.partial(shortcuts._new_driver, browser_type, **kargs)
+    )
+
+    sQ = AsyncSelector(driver)
+    await sQ.browser.get(url)
+    return sQ
+
+
+async def wait_for(*cnds, **kargs):
+    ''' Async version of selectq.wait_for(): the waiting happens in the
+        thread of the browser so the event loop is not blocked.
+        '''
+    if not cnds:
+        raise TypeError("Expected at least one condition.")
+
+    if any(isinstance(cnd, AsyncSelection) for cnd in cnds):
+        raise TypeError(
+            "Make the check explicit: 'selection != 0' for example"
+        )
+
+    browser = cnds[0].sel.browser
+    return await _call(browser, shortcuts.wait_for, *cnds, **kargs)
@@ -2,14 +2,48 @@ from lxml import etree
 
 from selenium.webdriver.common.by import By as SeleniumBy
 from selenium.webdriver.remote.webdriver import WebDriver as RemoteWebDriver
-from selenium.common.exceptions import JavascriptException
-
+from selenium.common.exceptions import JavascriptException, WebDriverException
+
+import codecs
+import collections
+import contextlib
+import copy
+import functools
+import threading
+import time
 import weakref
 import json
+import html
+import locale
+import re
 import os.path
 
+from .css import xpath_to_css
+from .profiling import Command, Profile, _payload_size, _selection_method
+
 GADGETS_DIR = os.path.join(os.path.dirname(__file__), 'gadgets')
 
+# Content of the gadgets files by path
+_gadgets_sources = {}
+
+
+def _read_gadget(filepath):
+    ''' Return the content of the gadget file, reading it from disk
+        only the first time.
+        '''
+    source = _gadgets_sources.get(filepath)
+    if source is None:
+        with open(filepath, 'rt') as f:
+            source = f.read()
+        _gadgets_sources[filepath] = source
+
+    return source
+
+
+# read the default gadgets once, at import time
+_read_gadget(os.path.join(GADGETS_DIR, 'selectq.css'))
+_read_gadget(os.path.join(GADGETS_DIR, 'selectq.js'))
+
 
 class Browser:
     def get(self, url):
@@ -17,16 +51,603 @@ class Browser:
             "The selection is unbound. Call sel.bind(browser) to bind it to a browser."
         )
 
+    def pluck(self, xpath, properties):
+        return self.get(None)
+
+    def count(self, xpath):
+        return self.get(None)
+
+    def invalidate(self):
+        ''' Forget anything that the browser keeps about the current
+            page because the page may have changed (see
+            WebBrowser.snapshot).
+            '''
+        pass
+
+    def wait_counts(self, conds, mode, timeout):
+        ''' Wait up to <timeout> seconds for the conditions, each
+            a tuple (xpath, sym, cnt), to hold: all of them if <mode>
+            is 'all' or any of them if it is 'any'. A condition holds
+            if the count of the elements selected by <xpath> compared
+            with <cnt> by the operator <sym> ('==', '>=', ...) is true.
+
+            Return a list with the outcome (True or False) of each
+            condition or None if the browser cannot be notified of
+            the changes in the document: the caller must poll instead.
+            '''
+        return None
+
+    def count_all(self, xpaths):
+        ''' Return a list with the count of the elements selected by
+            each of the <xpaths>.
+            '''
+        return [_value_of(self.count(xpath)) for xpath in xpaths]
+
+    def iter_pluck(self, xpath, properties, batch_size):
+        ''' Like pluck() but yield the results in lists of at most
+            <batch_size> elements.
+
+            Browsers that cannot retrieve the results incrementally
+            pluck them all at once and then split them.
+            '''
+        results = _value_of(self.pluck(xpath, properties))
+        for i in range(0, len(results), batch_size):
+            yield results[i:i + batch_size]
+
+    def table_cells(self, xpath):
+        ''' Return the cells of the table selected by <xpath> (exactly
+            one table must be selected): a list of rows, each row a list
+            of [text, rowspan, colspan], one per cell (<td> or <th>).
+
+            The rows of the nested tables are not included.
+            '''
+        return self.get(None)
+
+    def pluck_columns(self, xpath, properties):
+        ''' Like pluck() but return the values by property: a dictionary
+            of the <properties> and the list of their values, one value
+            per element selected.
+            '''
+        return _then(
+            self.pluck(xpath, properties),
+            lambda rows: _columns_of(properties, rows)
+        )
+
+    def iter_pluck_columns(self, xpath, properties, chunk_size):
+        ''' Like pluck_columns() but yield the columns of at most
+            <chunk_size> elements each time.
+            '''
+        for rows in self.iter_pluck(xpath, properties, chunk_size):
+            yield _columns_of(properties, rows)
+
+
+class XPathCache:
+    ''' Bounded cache of compiled XPath expressions (etree.XPath)
+        keyed by the xpath string.
+
+        lxml parses and compiles an xpath string each time that it is
+        evaluated with tree.xpath(); compiling it once and reusing it
+        pays off when the same selections are evaluated over and
+        over again against several documents.
+
+        When the cache is full, the least recently used compiled
+        expression is evicted.
+
+        The hits, misses and evictions are counted and can be
+        retrieved with stats().
+        '''
+    def __init__(self, maxsize=512):
+        if maxsize <= 0:
+            raise ValueError(
+                "The cache size must be a positive number but '{}' was received."
+                .format(maxsize)
+            )
+
+        self.maxsize = maxsize
+        self._compiled = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def compile(self, xpath):
+        ''' Return the compiled etree.XPath for the given <xpath>
+            compiling it only if it is not in the cache.
+            '''
+        with self._lock:
+            compiled = self._compiled.get(xpath)
+            if compiled is not None:
+                self._compiled.move_to_end(xpath)
+                self.hits += 1
+                return compiled
+
+        # compile it outside the lock: this may take a while
+        # or may fail if the xpath is invalid
+        compiled = etree.XPath(xpath, smart_strings=False)
+
+        with self._lock:
+            self.misses += 1
+            self._compiled[xpath] = compiled
+            self._compiled.move_to_end(xpath)
+            while len(self._compiled) > self.maxsize:
+                self._compiled.popitem(last=False)
+                self.evictions += 1
+
+        return compiled
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._compiled),
+                'maxsize': self.maxsize,
+            }
+
+    def clear(self):
+        ''' Drop all the compiled expressions and reset the counters. '''
+        with self._lock:
+            self._compiled.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+# Shared by all the FileBrowsers by default: the same selections
+# are likely to be evaluated against several documents.
+_xpath_cache = XPathCache()
+
+
+class DocumentCache:
+    ''' Cache of parsed documents keyed by the path of the file, its
+        modification time and its size so a modified file is parsed
+        again, and by how it was parsed (the encoding, ...) so
+        the browsers that parse it differently do not share it.
+
+        The cache is bounded by <max_bytes>, the sum of the sizes of the
+        files cached (the parsed trees take several times that). The
+        indexes of each document and the selections that it keeps
+        (see ElementIndex) are not counted either.
+        When the cache is full, the least recently used documents
+        are evicted. A <max_bytes> of 0 disables the cache.
+
+        The hits, misses and evictions are counted and can be
+        retrieved with stats().
+
+        Note: the cached trees are shared so they must not be modified.
+        '''
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        if max_bytes < 0:
+            raise ValueError(
+                "The cache size must be a non-negative number but '{}' was received."
+                .format(max_bytes)
+            )
+
+        self.max_bytes = max_bytes
+        self._documents = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self, path, parse, options=()):
+        ''' Return the document at <path> from the cache or call
+            <parse>(path) to parse it and cache it.
+
+            The <options> (a hashable) are what else the document
+            depends on, like the encoding used by <parse>.
+            '''
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, options)
+
+        with self._lock:
+            entry = self._documents.get(key)
+            if entry is not None:
+                self._documents.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+
+        # parse it outside the lock: this may take a while
+        doc = parse(path)
+
+        size = st.st_size
+        if size > self.max_bytes:
+            return doc
+
+        with self._lock:
+            if key not in self._documents:
+                self._documents[key] = doc
+                self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                (_, _, old_size, _), _ = self._documents.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+        return doc
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._documents),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def clear(self):
+        ''' Drop all the documents and reset the counters. '''
+        with self._lock:
+            self._documents.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+
+# Shared by all the FileBrowsers by default
+_document_cache = DocumentCache()
+
+
+class ElementIndex:
+    ''' A parsed document (its <root> element) with indexes of its
+        elements by tag, by id and by class token.
+
+        The indexes are built on first use in a single pass over the
+        document and they keep the elements in document order so a
+        simple selection like './/li[@class='cool']' takes the few
+        candidates from the indexes instead of scanning the whole
+        document.
+
+        Like the cached documents, the indexed document must not be
+        modified.
+        '''
+    def __init__(self, root, maxsize=128):
+        self.root = root
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._elements = None
+        self._selected = collections.OrderedDict()
+
+    def _build(self):
+        with self._lock:
+            if self._elements is not None:
+                return
+
+            by_tag = collections.defaultdict(list)
+            by_id = collections.defaultdict(list)
+            by_class = collections.defaultdict(list)
+            elements = []
+            for el in self.root.iter(etree.Element):
+                elements.append(el)
+                by_tag[el.tag].append(el)
+
+                id = el.get('id')
+                if id is not None:
+                    by_id[id].append(el)
+
+                # the same token twice must not index the element twice
+                for token in set((el.get('class') or '').split()):
+                    by_class[token].append(el)
+
+            self._by_tag = dict(by_tag)
+            self._by_id = dict(by_id)
+            self._by_class = dict(by_class)
+            self._elements = elements
+
+    def candidates(self, tag, id=None, classes=()):
+        ''' Return the elements in document order that may have the
+            <tag> (or any if '*'), the <id> and all the class tokens
+            in <classes>: the shortest list of elements from the
+            indexes.
+
+            The elements returned must be checked: only the shortest
+            list is taken, not the intersection of all of them.
+            '''
+        if self._elements is None:
+            self._build()
+
+        lists = [self._elements]
+        if tag != '*':
+            lists.append(self._by_tag.get(tag, []))
+        if id is not None:
+            lists.append(self._by_id.get(id, []))
+        for token in classes:
+            lists.append(self._by_class.get(token, []))
+
+        return min(lists, key=len)
+
+    def select(self, relative, tag, predicates, compile):
+        ''' Return the elements that have the <tag> and pass the
+            <predicates> like the xpath './/tag[...]' does (or
+            '//tag[...]' if not <relative>).
+
+            The <predicates> must not depend on the position nor
+            on the surroundings of the element: each candidate is
+            checked alone, with the xpath 'self::*[...]' compiled with
+            <compile> for the predicates that the indexes cannot answer.
+
+            The document does not change so the last <maxsize>
+            selections are remembered and returned as they are.
+            '''
+        key = (relative, tag, tuple(predicates))
+        with self._lock:
+            selected = self._selected.get(key)
+            if selected is not None:
+                self._selected.move_to_end(key)
+                return selected
+
+        selected = self._select(relative, tag, predicates, compile)
+
+        with self._lock:
+            self._selected[key] = selected
+            while len(self._selected) > self.maxsize:
+                self._selected.popitem(last=False)
+
+        return selected
+
+    def _select(self, relative, tag, predicates, compile):
+        id, classes = None, ()
+        attrs = []  # checked here
+        others = []  # checked with xpath
+        for predicate in predicates:
+            m = _indexed_predicate_re.match(predicate)
+            if not m:
+                others.append(predicate)
+                continue
+
+            attr, value = m.group(1), _literal_value(m.group(2), m.group(3))
+            attrs.append((attr, value))
+            if attr == 'id':
+                id = value
+            elif value.split():
+                classes = value.split()
+
+        is_selected = None
+        if others:
+            is_selected = compile('self::*' + ''.join(others))
+
+        candidates = self.candidates(tag, id, classes)
+        check_tag = tag != '*' and candidates is not self._by_tag.get(tag)
+
+        selected = []
+        for el in candidates:
+            if relative and el is self.root:
+                continue  # './/' selects the descendants only
+            if check_tag and el.tag != tag:
+                continue
+            if any(el.get(attr) != value for attr, value in attrs):
+                continue
+            if is_selected is None or is_selected(el):
+                selected.append(el)
+
+        return selected
+
 
 class FileBrowser(Browser):
-    ''' Simple browser to load a file-based HTML. '''
+    ''' Simple browser to load a file-based HTML.
+
+        The xpaths are compiled once and cached in <xpath_cache>
+        (see XPathCache) and the parsed documents are cached in
+        <document_cache> (see DocumentCache). By default caches shared
+        among all the FileBrowsers are used.
+
+        The files are decoded using <encoding>, by default, the same
+        encoding used by open().
+
+        If <streaming> is True, the file is not loaded in memory:
+        each read parses the file incrementally and yields the selected
+        elements as soon as they are found, discarding the rest.
+        See iter_elements() for the selections supported in this mode.
+
+        Otherwise, if <indexes> is True, the simple selections like
+        './/li[@class='cool']' are answered from the indexes of the
+        document by tag, id and class (see ElementIndex) instead of
+        scanning the whole document each time.
+        '''
+    def __init__(
+        self,
+        xpath_cache=None,
+        streaming=False,
+        document_cache=None,
+        encoding=None,
+        indexes=True
+    ):
+        super().__init__()
+        if xpath_cache is None:
+            xpath_cache = _xpath_cache
+        if document_cache is None:
+            document_cache = _document_cache
+
+        self.xpath_cache = xpath_cache
+        self.document_cache = document_cache
+        self.streaming = streaming
+        self.indexes = indexes
+        # libxml2 does not know Python's aliases like 'latin-1'
+        self.encoding = codecs.lookup(
+            encoding or locale.getpreferredencoding(False)
+        ).name
+
     def get(self, url):
         self._url = url
-        self._fetch_xml_str_and_build_tree()
+        if self.streaming:
+            self.document = self.tree = None
+        else:
+            self._fetch_and_build_tree()
+
+    def load_html(self, html):
+        ''' Load the document from the <html> string instead of
+            from a file. The document is not cached.
+            '''
+        parser = etree.HTMLParser(remove_blank_text=True)
+        root = etree.fromstring(html, parser)
+        if root is None:
+            raise ValueError("The html has no elements.")
+
+        self._url = None
+        self.document = ElementIndex(root)
+        self.tree = root
+
+    def xpath(self, xpath):
+        ''' Evaluate the <xpath> against the current document using
+            the compiled expression from the cache.
+            '''
+        if self.tree is None:
+            raise Exception(
+                "The document is not loaded in memory (streaming mode)."
+            )
+        return self.xpath_cache.compile(xpath)(self.tree)
+
+    def iter_elements(self, xpath):
+        ''' Iterate over the elements selected by <xpath>.
+
+            In streaming mode the file is parsed incrementally with
+            lxml's iterparse and each element yielded is valid only
+            until the next one is requested: after that it is cleared
+            to keep the memory usage flat.
+
+            Only the most common selection is supported in this mode:
+            a descendant tag with predicates that depend on the element
+            and its content only like the ones built by Selection.select:
+
+                .//li[@class='cool'][ends-with(@href, '.pdf')]
+                .//*[@id='uniq'][text()='foo']
+
+            Positional predicates or predicates that look outside of
+            the element (parents, siblings) are not supported.
+
+            The memory is bounded by the size of the largest element
+            that has the tag and the attributes required (a
+            "candidate"): its content must be kept until the element
+            is fully parsed.
+
+            The same selections are answered from the indexes of the
+            document when it is loaded in memory (unless <indexes> is
+            False): only the candidates with the tag, the id
+            ('[@id='uniq']') and the classes ('[@class='cool']')
+            required are checked.
+            '''
+        if not self.streaming:
+            selected = self._indexed(xpath)
+            if selected is None:
+                selected = self.xpath(xpath)
+            return iter(selected)
+
+        step = _split_streamable_step(xpath)
+        if step is None:
+            raise ValueError(
+                "The xpath '{}' cannot be evaluated in streaming mode. Only a descendant step like './/tag[...]' with predicates that do not depend on the position nor on the surroundings of the element is supported."
+                .format(xpath)
+            )
+
+        return self._iterparse(*step)
+
+    def count(self, xpath):
+        ''' Count the elements selected by <xpath> using XPath's count()
+            (or the indexes) so no list of elements is built.
+            '''
+        if self.streaming:
+            return sum(1 for _ in self.iter_elements(xpath))
+
+        selected = self._indexed(xpath)
+        if selected is not None:
+            return len(selected)
+        return int(self.xpath('count({})'.format(xpath)))
+
+    def _indexed(self, xpath):
+        ''' Return the elements selected by <xpath> from the indexes
+            of the document or None if the indexes cannot answer it.
+            '''
+        if not self.indexes:
+            return None
+
+        step = _split_streamable_step(xpath)
+        if step is None:
+            return None
+
+        relative, tag, _, predicates = step
+        return self.document.select(
+            relative, tag, predicates, self.xpath_cache.compile
+        )
+
+    def pluck(self, xpath, properties):
+        ''' Retrieve the given <properties> of each element selected
+            by <xpath>, one list of values per element.
+
+            The properties are the names of the properties of a DOM
+            element like 'textContent', 'outerHTML' or 'className'
+            and they are mapped to their lxml counterparts.
+
+            Any other name is taken as the name of an attribute of
+            the element (None if the element does not have it).
+            '''
+        getters = [_property_getter(prop) for prop in properties]
+        return [
+            [get(el) for get in getters] for el in self.iter_elements(xpath)
+        ]
+
+    def iter_pluck(self, xpath, properties, batch_size):
+        ''' Like pluck() but yield the results in lists of at most
+            <batch_size> elements.
+
+            In streaming mode, only a batch is kept in memory.
+            '''
+        getters = [_property_getter(prop) for prop in properties]
+        batch = []
+        for el in self.iter_elements(xpath):
+            batch.append([get(el) for get in getters])
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def table_cells(self, xpath):
+        ''' Return the cells of the table selected by <xpath> (see
+            Browser.table_cells) walking its rows once.
+
+            The cells are read as soon as the table is found: in
+            streaming mode the table is cleared once the next element
+            is requested.
+            '''
+        tables = []
+        for table in self.iter_elements(xpath):
+            if not tables:
+                cells = self._table_cells(table)
+            tables.append(table)
+
+        _expect_count(tables, 1)
+        return cells
+
+    def _table_cells(self, table):
+        compile = self.xpath_cache.compile
+
+        # the same order than the DOM's table.rows: the header, the
+        # body and the footer
+        rows = compile('thead/tr')(table) + \
+            compile('tr | tbody/tr')(table) + compile('tfoot/tr')(table)
+
+        cells = compile('td | th')
+        return [
+            [
+                [
+                    _text_content(cell),
+                    _span(cell.get('rowspan')),
+                    _span(cell.get('colspan'))
+                ] for cell in cells(row)
+            ] for row in rows
+        ]
 
     def pprint(self, xpath):
-        elems = self.tree.xpath(xpath)
-        for el in elems:
+        for el in self.iter_elements(xpath):
+            # indent a copy: the document must remain untouched
+            # for the next reads
+            el = copy.deepcopy(el)
             _indent(el)
             print(
                 etree.tostring(
@@ -39,15 +660,615 @@ class FileBrowser(Browser):
                 end=''
             )
 
-    def _fetch_xml_str_and_build_tree(self):
+    def _fetch_and_build_tree(self):
         ''' Fetch (if needed) and build a XML tree representing
             the html file.
             '''
-        with open(self._url, 'rt') as f:
-            html = f.read()
+        self.document = self.document_cache.load(
+            self._url,
+            self._parse_file,
+            options=tuple(sorted(self._parser_options().items()))
+        )
+        self.tree = self.document.root
+
+    def _parser_options(self):
+        return {'remove_blank_text': True, 'encoding': self.encoding}
+
+    def _parse_file(self, path):
+        ''' Parse the file straight from disk: there is no need
+            to read and decode it into a string first.
+            '''
+        parser = etree.HTMLParser(**self._parser_options())
+        return ElementIndex(etree.parse(path, parser).getroot())
+
+    def _iterparse(self, relative, tag, attr_predicates, predicates):
+        ''' Parse the file incrementally yielding the elements that
+            have the <tag> and pass all the <predicates>.
+
+            An element is a "candidate" if it has the <tag> and it passes
+            the <attr_predicates> which can be evaluated as soon as the
+            element starts. The content of the candidates are kept until
+            they end so the rest of the predicates can be evaluated;
+            anything else is cleared once it ends.
+            '''
+        is_candidate = self.xpath_cache.compile(
+            'self::' + tag + ''.join(attr_predicates)
+        )
+        is_selected = self.xpath_cache.compile(
+            'self::' + tag + ''.join(predicates)
+        )
+
+        context = etree.iterparse(
+            self._url,
+            events=('start', 'end'),
+            html=True,
+            remove_blank_text=True,
+            huge_tree=True,
+            encoding=self.encoding
+        )
+
+        root = None
+        candidates = []  # one flag per open element
+        open_candidates = 0
+
+        # candidates in document order: [element, decided, selected]
+        # The nested candidates end before their ancestors so they
+        # are hold here until the ancestors are decided
+        pending = collections.deque()
+        for event, el in context:
+            if event == 'start':
+                if root is None:
+                    root = el
+                    # './/tag' selects descendants of the root only
+                    candidate = not relative and bool(is_candidate(el))
+                else:
+                    candidate = bool(is_candidate(el))
+
+                candidates.append(candidate)
+                if candidate:
+                    open_candidates += 1
+                    pending.append([el, False, False])
+                continue
+
+            if candidates.pop():
+                open_candidates -= 1
+                for entry in reversed(pending):
+                    if entry[0] is el:
+                        entry[1:] = True, bool(is_selected(el))
+                        break
+
+                while pending and pending[0][1]:
+                    el_, _, selected = pending.popleft()
+                    if selected:
+                        yield el_
+
+            if open_candidates == 0:
+                # nobody needs this element anymore: clear it and
+                # drop the already processed siblings
+                el.clear(keep_tail=True)
+                parent = el.getparent()
+                if parent is not None:
+                    while el.getprevious() is not None:
+                        del parent[0]
+
+        del context
+
+
+def _text_content(el):
+    return ''.join(el.itertext())
+
+
+def _span(value):
+    ''' Parse the rowspan/colspan attribute like the DOM does: 1 if it
+        is missing or invalid.
+        '''
+    try:
+        span = int(value)
+    except (TypeError, ValueError):
+        return 1
+
+    return span if span >= 0 else 1
+
+
+def _expect_count(elems, expected):
+    if len(elems) != expected:
+        raise Exception(
+            "Unexpected count. Expected {} but selected {}.".format(
+                expected, len(elems)
+            )
+        )
+
+
+_not_rendered_tags = ('script', 'style', 'template', 'noscript')
+_whitespace_run_re = re.compile(r'\s+')
+
+
+def _inner_text(el):
+    ''' Approximate the DOM's innerText: the text of the non-rendered
+        elements like <script> is not included and the whitespace
+        is collapsed as the browsers do when the text is rendered.
+        '''
+    if el.tag in _not_rendered_tags:
+        return ''
+
+    chunks = [el.text or '']
+    for child in el:
+        if isinstance(child.tag, str):
+            chunks.append(_inner_text(child))
+        chunks.append(child.tail or '')
+
+    return _whitespace_run_re.sub(' ', ''.join(chunks)).strip()
+
+
+def _outer_html(el):
+    return etree.tostring(
+        el, encoding='unicode', method='html', with_tail=False
+    )
+
+
+def _inner_html(el):
+    chunks = [html.escape(el.text or '', quote=False)]
+    chunks.extend(
+        etree.tostring(child, encoding='unicode', method='html')
+        for child in el
+    )
+    return ''.join(chunks)
+
+
+def _child_element_count(el):
+    return sum(1 for child in el if isinstance(child.tag, str))
+
+
+# DOM element's properties and how to compute them from an lxml element
+_element_properties = {
+    'textContent': _text_content,
+    'innerText': _inner_text,
+    'outerHTML': _outer_html,
+    'innerHTML': _inner_html,
+    'tagName': lambda el: el.tag.upper(),
+    'nodeName': lambda el: el.tag.upper(),
+    'localName': lambda el: el.tag,
+    'id': lambda el: el.get('id', ''),
+    'className': lambda el: el.get('class', ''),
+    'htmlFor': lambda el: el.get('for', ''),
+    'childElementCount': _child_element_count,
+}
+
+# Properties that make sense for text nodes (the xpath selected strings)
+_text_properties = ('textContent', 'innerText', 'nodeValue', 'data')
+
+
+def _property_getter(prop):
+    ''' Return a function that computes the property <prop> of an lxml
+        element (or of a string if the xpath selected text nodes or
+        attributes).
+        '''
+    getter = _element_properties.get(prop)
+    if getter is None:
+        getter = lambda el: el.get(prop)
+
+    is_text_prop = prop in _text_properties
+
+    def get(el):
+        if isinstance(el, str):
+            return el if is_text_prop else None
+        return getter(el)
+
+    return get
+
+
+def _check_properties(properties):
+    if not properties:
+        raise ValueError('The property list is empty.')
+
+    if not isinstance(properties, (list, tuple)):
+        raise TypeError(
+            "Invalid type for the property list. Expected 'list' or 'tuple' but found '{}'."
+            .format(type(properties))
+        )
+
+
+def _split_predicates(s):
+    ''' Split a sequence of predicates like "[a][b]" into a list of
+        the predicates (with their brackets).
+
+        Return None if <s> is not a sequence of predicates.
+        '''
+    predicates = []
+    depth = 0
+    quote = None
+    begin = 0
+    for i, c in enumerate(s):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c == '[':
+            if depth == 0:
+                begin = i
+            depth += 1
+        elif c == ']':
+            depth -= 1
+            if depth < 0:
+                return None
+            if depth == 0:
+                predicates.append(s[begin:i + 1])
+        elif depth == 0:
+            return None
+
+    if depth != 0 or quote:
+        return None
+
+    return predicates
+
+
+# predicates answered by the indexes of ElementIndex
+_indexed_predicate_re = re.compile(
+    r'''^\[\s*@(id|class)\s*=\s*(?:'([^']*)'|"([^"]*)")\s*\]$'''
+)
+
+
+def _literal_value(single_quoted, double_quoted):
+    return single_quoted if single_quoted is not None else double_quoted
+
+
+_string_literal_re = re.compile(r'"[^"]*"|\'[^\']*\'')
+_streaming_step_re = re.compile(
+    r'^(\.?//)(\*|[A-Za-z_][\w.-]*)(.*)$', re.DOTALL
+)
+_name_token_re = re.compile(r'(@?)([A-Za-z_][\w.-]*)(\s*\(\s*\)|\s*\()?')
+
+# predicates that depends on the position or on things outside of
+# the element cannot be evaluated while the document is being parsed
+_not_streamable_predicate_re = re.compile(
+    r'position\s*\(|last\s*\(|\.\.|::|(^|[\s(\[,=<>!|+-])/|^\[\s*[\d.]+\s*\]$'
+)
+
+# a predicate that is just a number is a positional predicate
+_numeric_predicate_re = re.compile(
+    r'^\[\s*(count|sum|number|string-length|floor|ceiling|round)\s*\([^=<>]*\)\s*\]$'
+)
+
+# functions that do not depend on the element when called with arguments
+_attr_functions = {
+    'starts-with', 'ends-with', 'contains', 'concat', 'translate',
+    'normalize-space', 'string-length', 'substring', 'substring-before',
+    'substring-after', 'not', 'true', 'false', 'number', 'string', 'boolean',
+    'name', 'local-name', 'lower-case', 'upper-case'
+}
+
+# functions that depend on the element's content when called without
+# arguments
+_content_functions = {'normalize-space', 'string-length', 'number', 'string'}
+
+_operators = {'and', 'or', 'div', 'mod'}
+
+
+def _is_attr_predicate(predicate):
+    ''' Return True if the predicate depends only on the element's
+        attributes (and name) so it can be evaluated when the element
+        starts, before its content is parsed.
+        '''
+    if '@' not in predicate:
+        return False
+
+    for at, name, call in _name_token_re.findall(predicate):
+        if at or name in _operators:
+            continue
+
+        if not call or name not in _attr_functions:
+            return False
+
+        if name in _content_functions and call.rstrip().endswith(')'):
+            return False
+
+    # the dot (self) must not appear except as part of numbers
+    return re.search(r'(?<![\w\d])\.(?!\d)', predicate) is None
+
+
+def _split_streamable_step(xpath):
+    ''' Split an xpath like './/tag[a][b]' into a tuple (relative, tag,
+        attr_predicates, predicates) if the xpath can be evaluated in
+        streaming mode, None otherwise.
+        '''
+    m = _streaming_step_re.match(xpath.strip())
+    if not m:
+        return None
+
+    prefix, tag, rest = m.groups()
+    predicates = _split_predicates(rest)
+    if predicates is None:
+        return None
+
+    attr_predicates = []
+    for predicate in predicates:
+        stripped = _string_literal_re.sub("''", predicate)
+        if _not_streamable_predicate_re.search(stripped) or \
+                _numeric_predicate_re.match(stripped):
+            return None
+
+        if _is_attr_predicate(stripped[1:-1]):
+            attr_predicates.append(predicate)
+
+    return prefix == './/', tag, attr_predicates, predicates
+
+
+def _css_injection_js(css):
+    ''' Return a script that adds the <css> to the current page. '''
+    return '''
+    var style = document.createElement('style');
+    style.type = 'text/css';
+    style.innerHTML = {css};
+    document.getElementsByTagName('head')[0].appendChild(style);
+    '''.format(css=json.dumps(css))
+
+
+class Pending:
+    ''' The result of a read queued in a batch (see WebBrowser.batch).
+
+        The result is available from the 'value' attribute once the
+        batch is executed; reading it before forces the execution.
+        '''
+    def __init__(self, batch):
+        self._batch = batch
+        self._done = False
+        self._value = None
+        self._error = None
+        self._callbacks = []
+
+    @property
+    def done(self):
+        return self._done
+
+    @property
+    def value(self):
+        if not self._done:
+            self._batch.flush()
+
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def then(self, fn):
+        ''' Return a new Pending which value will be <fn>(value). '''
+        pending = Pending(self._batch)
+        if self._done:
+            pending._resolve(self._value, self._error, fn)
+        else:
+            self._callbacks.append((pending, fn))
+        return pending
+
+    def _resolve(self, value, error, fn=None):
+        if error is None and fn is not None:
+            try:
+                value = fn(value)
+            except Exception as e:
+                error = e
+
+        self._value, self._error, self._done = value, error, True
+        for pending, fn in self._callbacks:
+            pending._resolve(value, error, fn)
+        self._callbacks = []
+
+    def __repr__(self):
+        if not self._done:
+            return 'Pending'
+        return 'Pending {!r}'.format(self._value)
+
+
+def _columns_of(properties, rows):
+    ''' Transpose the <rows> of values (one per element) into
+        a dictionary of <properties> and their values.
+        '''
+    return {
+        prop: [row[i] for row in rows]
+        for i, prop in enumerate(properties)
+    }
+
+
+def _then(result, fn):
+    ''' Call <fn> with the result, now or when the result is available
+        if it is a Pending.
+        '''
+    if isinstance(result, Pending):
+        return result.then(fn)
+    return fn(result)
+
+
+def _value_of(result):
+    ''' Return the value of the result, executing its batch if it is
+        a Pending.
+        '''
+    if isinstance(result, Pending):
+        return result.value
+    return result
+
+
+class Batch:
+    ''' Queue of reads that are executed together in a single script.
+        See WebBrowser.batch.
+        '''
+    def __init__(self, browser):
+        self.browser = browser
+        self._queue = []
+
+    def add(self, kind, xpath, args=None):
+        pending = Pending(self)
+        self._queue.append((kind, xpath, args, pending))
+        return pending
+
+    def flush(self):
+        ''' Execute the queued reads now. '''
+        queue, self._queue = self._queue, []
+        if not queue:
+            return
+
+        requests = [[kind, xpath, args] for kind, xpath, args, _ in queue]
+        try:
+            results = self.browser._run_batch(requests)
+        except Exception as err:
+            # the script failed as a whole (the driver is gone, ...):
+            # so did each read
+            for _, _, _, pending in queue:
+                pending._resolve(None, err)
+            raise
+
+        for (_, xpath, _, pending), (ok, result) in zip(queue, results):
+            if ok:
+                pending._resolve(result, None)
+            else:
+                pending._resolve(
+                    None,
+                    JavascriptException(
+                        "{} (xpath: {})".format(result, xpath)
+                    )
+                )
+
+
+# Prefix for the scripts that require the gadgets (see
+# WebBrowser._load_gadgets): WebBrowser._execute loads them on demand.
+_not_gadgets_loaded_msj = 'selectq undefined - ijs98uduh'
+_gadgets_guard = '''if (typeof window.selectq === 'undefined')
+    throw new Error("{}");'''.format(_not_gadgets_loaded_msj)
+
+# Scripts that call the gadgets' runtime (see selectq.run in selectq.js):
+# only the arguments change from call to call.
+_run_script = _gadgets_guard + '''
+return selectq.run(arguments[0], arguments[1], arguments[2]);'''
+
+_run_batch_script = _gadgets_guard + '''
+return selectq.run_batch(arguments[0]);'''
+
+_wait_all_script = _gadgets_guard + '''
+selectq.wait_for_all(arguments[0], arguments[1], arguments[2],
+                     arguments[arguments.length - 1]);'''
+
+_run_cached_script = _gadgets_guard + '''
+return selectq.run_cached(arguments[0], arguments[1], arguments[2],
+                          arguments[3]);'''
+
+_outer_html_script = '''
+return document.documentElement.outerHTML;'''
+
+# The operations that change the page (see WebBrowser.snapshot)
+_page_changing_operations = {'click', 'clear', 'set_values', 'fill'}
+
+# The reads which results can be cached (see WebBrowser.cached)
+_cacheable_operations = {'count', 'pluck', 'pluck_columns', 'table_cells'}
+
+# Extra time given to the driver for an async script over the time
+# that the script waits by itself.
+_script_timeout_margin = 5
 
-        parser = etree.HTMLParser(remove_blank_text=True)
-        self.tree = etree.fromstring(html, parser)
+
+class ReadCache:
+    ''' Cache of the results of the reads of a WebBrowser validated
+        by the version of the page (see WebBrowser.cached).
+
+        The hits and misses are counted and can be retrieved
+        with stats().
+        '''
+    def __init__(self, browser, maxsize=256):
+        if maxsize <= 0:
+            raise ValueError(
+                "The cache size must be a positive number but '{}' was received."
+                .format(maxsize)
+            )
+
+        self.browser = browser
+        self.maxsize = maxsize
+        self._results = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def run(self, kind, xpath, args=None):
+        ''' Run the operation <kind> in the browser (see WebBrowser.run)
+            unless the page did not change since its result was cached.
+            '''
+        key = (kind, xpath, json.dumps(args, sort_keys=True))
+        entry = self._results.get(key)
+        version = None if entry is None else entry[0]
+
+        browser = self.browser
+        version, hit, result = browser._execute(
+            _run_cached_script,
+            version,
+            kind,
+            browser._query(xpath),
+            args,
+            operation=kind,
+            xpath=xpath
+        )
+
+        if hit:
+            self.hits += 1
+            self._results.move_to_end(key)
+            # a copy: the caller may modify it
+            return copy.deepcopy(entry[1])
+
+        self.misses += 1
+        self._results[key] = (version, result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+        return copy.deepcopy(result)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._results),
+            'maxsize': self.maxsize,
+        }
+
+    def clear(self):
+        ''' Drop all the results and reset the counters. '''
+        self._results.clear()
+        self.hits = self.misses = 0
+
+
+class Snapshot:
+    ''' Local copy of the page of a WebBrowser (see
+        WebBrowser.snapshot).
+
+        The number of times that the page was pulled and the number of
+        reads served from the copy are in 'pulls' and 'reads'.
+        '''
+    def __init__(self, browser):
+        self.browser = browser
+        self.pulls = 0
+        self.reads = 0
+        self._page = None
+
+    @property
+    def page(self):
+        ''' The FileBrowser with the copy of the page. The page is
+            pulled if there is no copy or if it was invalidated.
+            '''
+        if self._page is None:
+            browser = self.browser
+
+            # the queued interactions must happen before the pull
+            if browser._batch is not None:
+                browser._batch.flush()
+
+            html = browser._execute(_outer_html_script, operation='snapshot')
+            page = FileBrowser()
+            page.load_html(html)
+
+            self._page = page
+            self.pulls += 1
+
+        return self._page
+
+    def invalidate(self):
+        self._page = None
+
+    def __repr__(self):
+        return '<Snapshot pulls={} reads={}>'.format(self.pulls, self.reads)
 
 
 def _quit_driver(driver):
@@ -56,7 +1277,7 @@ def _quit_driver(driver):
 
 
 class WebBrowser(Browser):
-    def __init__(self, driver):
+    def __init__(self, driver, css=True):
         super().__init__()
         self.driver = driver
         # ensure that we quit the driver eventually
@@ -67,8 +1288,34 @@ class WebBrowser(Browser):
             ('js', os.path.join(GADGETS_DIR, 'selectq.js')),
         ]
 
+        self._batch = None
+        self._profiles = []
+        # the operation and the xpath of the commands being sent
+        # (see _driver_call)
+        self._described = (None, None)
+        # the script timeout set in the driver (see wait_counts)
+        self._script_timeout = None
+        self._snapshot = None
+        self._cache = None
+
+        # evaluate the selections that CSS can express with
+        # querySelectorAll (see _query)
+        self.css = css
+        self._engines = collections.Counter()
+
+        # the current page may not have the gadgets: bundle them
+        # with the first script (see _execute)
+        self._gadgets_pending = True
+        self._gadgets_preloaded = self._preload_gadgets()
+
     def get(self, url):
-        self.driver.get(url)
+        self.invalidate()
+        if self._cache is not None:
+            self._cache.clear()
+        self._driver_call(self.driver.get, url, operation='get')
+
+        # a new page has no gadgets unless the driver preloads them
+        self._gadgets_pending = not self._gadgets_preloaded
 
     def __del__(self):
         try:
@@ -88,8 +1335,11 @@ class WebBrowser(Browser):
         ''' Load a local javascript file and inject it into the current
             window/frame.
             '''
+        self.invalidate()
         with open(filepath, 'rt') as f:
-            self.driver.execute_script(f.read())
+            self._driver_call(
+                self.driver.execute_script, f.read(), operation='load_js'
+            )
 
     def _load_gadgets(self):
         ''' Load CSS/JS files into the current web page. These files are
@@ -105,28 +1355,77 @@ class WebBrowser(Browser):
             If a CSS/JS files needs to be added not by default you can
             call load_css_file()/load_js_file() explicitly.
             '''
+        self._gadgets_pending = False
+        self._driver_call(
+            self.driver.execute_script,
+            self._gadgets_js(),
+            operation='load_gadgets'
+        )
+
+    def _gadgets_js(self, preload=False):
+        ''' Return a script that injects the gadgets into the current
+            web page if they are not already there.
+
+            If <preload> is True, the script is meant to be executed
+            before the document is loaded so the CSS files are injected
+            when the document is ready.
+
+            The content of the files is read once and cached.
+            '''
+        chunks = []
         for type, filename in self._gadgets_files:
+            source = _read_gadget(filename)
             if type == 'css':
-                self.load_css_file(os.path.join(GADGETS_DIR, 'selectq.css'))
+                js = _css_injection_js(source)
+                if preload:
+                    js = '''
+                    document.addEventListener('DOMContentLoaded', function () {{
+                    {js}
+                    }});
+                    '''.format(js=js)
+                chunks.append(js)
             elif type == 'js':
-                self.load_js_file(os.path.join(GADGETS_DIR, 'selectq.js'))
+                chunks.append(source)
             else:
                 raise ValueError(
                     "Gadget type '{}' is not supported.".format(type)
                 )
 
+        return '''
+        if (typeof window.selectq === 'undefined') {{
+        {gadgets}
+        }}
+        '''.format(gadgets='\n'.join(chunks))
+
+    def _preload_gadgets(self):
+        ''' Ask the driver to load the gadgets in every new document
+            so they are there before any script is executed.
+
+            This is supported by the drivers that speak the Chrome
+            DevTools protocol (Chrome, Edge). For the rest, the gadgets
+            are bundled with the first script executed after get()
+            or loaded on demand by _execute().
+
+            Return True if the driver accepted.
+            '''
+        try:
+            self.driver.execute_cdp_cmd(
+                'Page.addScriptToEvaluateOnNewDocument',
+                {'source': self._gadgets_js(preload=True)}
+            )
+        except Exception:
+            # not supported by the driver, this is just an optimization
+            return False
+
+        return True
+
     def load_css_file(self, filepath):
         with open(filepath, 'rt') as f:
-            css = json.dumps(f.read())
+            jsstyle = _css_injection_js(f.read())
 
-        jsstyle = '''
-        var style = document.createElement('style');
-        style.type = 'text/css';
-        style.innerHTML = {css};
-        document.getElementsByTagName('head')[0].appendChild(style);
-        '''.format(css=css)
-
-        self.driver.execute_script(jsstyle)
+        self._driver_call(
+            self.driver.execute_script, jsstyle, operation='load_css'
+        )
 
     def js_process_elems(self, xpath, jsbegin, jsforeach, jsend):
         ''' Retrieve the elements selected by <xpath> and iterate
@@ -154,8 +1453,8 @@ class WebBrowser(Browser):
             high-level methods.
         '''
 
-        not_gadgets_loaded_msj = 'selectq undefined - ijs98uduh'
-
+        self.invalidate()
+        operation = dict(operation='js_process_elems', xpath=xpath)
         xpath = json.dumps(xpath)
         context_node = 'document'
         namespace_resolver = 'null'
@@ -163,9 +1462,7 @@ class WebBrowser(Browser):
         existing_result = 'null'
 
         jsexecute = '''
-        if (typeof window.selectq === 'undefined') {{
-            throw new Error("{not_gadgets_loaded_msj}");
-        }}
+        {gadgets_guard}
 
         var elems_iter = document.evaluate({xpath}, {context_node},
         {namespace_resolver}, {result_type}, {existing_result});
@@ -179,7 +1476,7 @@ class WebBrowser(Browser):
 
         {jsend}
         '''.format(
-            not_gadgets_loaded_msj=not_gadgets_loaded_msj,
+            gadgets_guard=_gadgets_guard,
             xpath=xpath,
             context_node=context_node,
             namespace_resolver=namespace_resolver,
@@ -190,14 +1487,140 @@ class WebBrowser(Browser):
             jsend=jsend
         )
 
+        return self._execute(jsexecute, **operation)
+
+    def _execute(
+        self, script, *args, execute=None, operation=None, xpath=None
+    ):
+        ''' Execute the <script> with the given arguments.
+
+            The script is executed with <execute>, the driver's
+            execute_script by default. The <operation> and the <xpath>
+            describe the script for the profiles (see profile()).
+
+            The first script after a page is loaded carries the gadgets
+            too so they are injected without an extra round trip.
+
+            If the script requires the gadgets (see _gadgets_guard) and
+            they are not loaded (the page changed without calling get(),
+            after a click for example), load them and retry.
+            '''
+        if execute is None:
+            execute = self.driver.execute_script
+
+        if self._gadgets_pending:
+            self._gadgets_pending = False
+            script = self._gadgets_js() + script
+
+        call = functools.partial(
+            self._driver_call, execute, operation=operation, xpath=xpath
+        )
         try:
-            return self.driver.execute_script(jsexecute)
+            return call(script, *args)
         except JavascriptException as e:
-            if not_gadgets_loaded_msj not in str(e):
+            if _not_gadgets_loaded_msj not in str(e):
                 raise
 
             self._load_gadgets()
-            return self.driver.execute_script(jsexecute)
+            return call(script, *args)
+
+    def _driver_call(self, fn, *args, operation=None, xpath=None):
+        ''' Call the driver's method <fn> with the <args>. The commands
+            that it sends are recorded in the active profiles, if any,
+            with the <operation> and the <xpath> (see _record()).
+            '''
+        if not self._profiles:
+            return fn(*args)
+
+        outer = self._described
+        self._described = (operation, xpath)
+        try:
+            return fn(*args)
+        finally:
+            self._described = outer
+
+    def _hook_driver(self):
+        ''' Replace the driver's execute(), the method that the driver
+            and its WebElements call to send every command, by one that
+            records the commands (see _record()).
+
+            Return a function that restores the driver.
+            '''
+        driver = self.driver
+        prev = vars(driver).get('execute')
+        execute = driver.execute
+
+        def recorded(driver_command, params=None):
+            return self._record(execute, driver_command, params)
+
+        def restore():
+            if prev is None:
+                del driver.execute
+            else:
+                driver.execute = prev
+
+        driver.execute = recorded
+        return restore
+
+    def _record(self, execute, driver_command, params):
+        ''' Send the command with <execute> and record it in the active
+            profiles.
+            '''
+        method = _selection_method()
+        operation, xpath = self._described
+        result = error = None
+        begin = time.perf_counter()
+        try:
+            response = execute(driver_command, params)
+            if response:
+                result = response.get('value')
+            return response
+        except BaseException as err:
+            error = err
+            raise
+        finally:
+            command = Command(
+                driver_command, method, operation, xpath,
+                _payload_size(params), _payload_size(result),
+                time.perf_counter() - begin, error
+            )
+            for profile in self._profiles:
+                profile.record(command)
+
+    @contextlib.contextmanager
+    def profile(self, hooks=()):
+        ''' Context manager that records each command sent to the
+            driver: the Selection's method that caused it, the
+            operation, the xpath, the bytes sent and received and
+            the wall time (see Command in profiling.py).
+
+                with sQ.browser.profile() as p:
+                    rows = sQ.select('tr').text()
+                    ...
+
+                print(p.report())
+
+            Each of the <hooks> is called with each Command as soon
+            as it completes, to export them to other systems.
+
+            All the commands are recorded, the ones sent by the
+            WebElements (native click(), send_keys(), ...) and by
+            switching frames too.
+
+            The profiles can be nested: a command is recorded in all
+            the active profiles.
+            '''
+        # the outermost profile hooks the driver
+        restore = None if self._profiles else self._hook_driver()
+
+        profile = Profile(hooks)
+        self._profiles.append(profile)
+        try:
+            yield profile
+        finally:
+            self._profiles.remove(profile)
+            if restore is not None:
+                restore()
 
     def js_map(self, xpath, jscall):
         ''' Execute the javascript function call <jscall> for each
@@ -210,15 +1633,22 @@ class WebBrowser(Browser):
 
             Note that the <jscall> must end in a semicolon.
             '''
-        jsbegin = 'var elems = []; var results = [];'
-        jsend = 'return results;'
-
-        jsforeach = '''
-        var tmp = {jscall}
-        results.push(tmp);
-        '''.format(jscall=jscall)
+        self.invalidate()
+        jsexecute = '''
+        {gadgets_guard}
+        var elems = selectq.select(arguments[0]);
+        var results = [];
+        for (var i = 0; i < elems.length; i++) {{
+            var el = elems[i];
+            var tmp = {jscall}
+            results.push(tmp);
+        }}
+        return results;
+        '''.format(gadgets_guard=_gadgets_guard, jscall=jscall)
 
-        return self.js_process_elems(xpath, jsbegin, jsforeach, jsend)
+        return self._execute(
+            jsexecute, self._query(xpath), operation='js_map', xpath=xpath
+        )
 
     def js_call(self, xpath, jscall):
         ''' Execute the javascript function call <jscall> once over an array
@@ -234,33 +1664,458 @@ class WebBrowser(Browser):
 
             Note that the <jscall> must end in a semicolon.
             '''
-        jsbegin = 'var elems = [];'
-        jsforeach = 'elems.push(el);'
+        self.invalidate()
+        jsexecute = '''
+        {gadgets_guard}
+        var elems = selectq.select(arguments[0]);
+        {jscall}
+        '''.format(gadgets_guard=_gadgets_guard, jscall=jscall)
+
+        return self._execute(
+            jsexecute, self._query(xpath), operation='js_call', xpath=xpath
+        )
+
+    def run(self, kind, xpath, args=None):
+        ''' Execute the operation <kind> of the gadgets' runtime (see
+            selectq.run in selectq.js) over the elements selected by
+            <xpath>.
+
+            The script sent is always the same, only the <kind>, the
+            <xpath> and the <args> change and they are sent as JSON
+            arguments.
+            '''
+        return self._execute(
+            _run_script,
+            kind,
+            self._query(xpath),
+            args,
+            operation=kind,
+            xpath=xpath
+        )
+
+    def _query(self, xpath):
+        ''' Return the query for the gadgets' runtime: a {'css': selector}
+            if the <xpath> can be expressed in CSS (and css is enabled),
+            the <xpath> itself otherwise.
+            '''
+        if xpath is None:
+            return None
+
+        css = xpath_to_css(xpath) if self.css else None
+        if css is None:
+            self._engines['xpath'] += 1
+            return xpath
+
+        self._engines['css'] += 1
+        return {'css': css}
+
+    def engine_stats(self):
+        ''' Return how many queries were evaluated as CSS selectors
+            and how many as xpaths.
+            '''
+        return {'css': self._engines['css'], 'xpath': self._engines['xpath']}
 
-        jsend = jscall
+    def find_elements(self, xpath):
+        ''' Return the Selenium WebElements selected by the <xpath>.
 
-        return self.js_process_elems(xpath, jsbegin, jsforeach, jsend)
+            The WebElements are used to interact with the page so
+            the snapshot, if any, is invalidated.
+            '''
+        self.invalidate()
+        query = self._query(xpath)
+        if isinstance(query, dict):
+            by, query = SeleniumBy.CSS_SELECTOR, query['css']
+        else:
+            by = SeleniumBy.XPATH
+
+        return self._driver_call(
+            self.driver.find_elements,
+            by,
+            query,
+            operation='find_elements',
+            xpath=xpath
+        )
 
     def pluck(self, xpath, properties):
-        if not properties:
-            raise ValueError('The property list is empty.')
+        _check_properties(properties)
+        if self._snapshot is not None:
+            return self._local(lambda page: page.pluck(xpath, properties))
+        return self._request('pluck', xpath, list(properties))
+
+    def pluck_columns(self, xpath, properties):
+        ''' Pluck the <properties> in the page by column (see
+            Browser.pluck_columns).
+
+            The columns are sent back as a single JSON string: the
+            driver serializes a string much faster than a list of
+            values per element.
+
+            The values must be JSON values (strings, numbers, booleans
+            or null).
+            '''
+        _check_properties(properties)
+        if self._snapshot is not None:
+            return self._local(
+                lambda page: page.pluck_columns(xpath, properties)
+            )
+        return _then(
+            self._request('pluck_columns', xpath, list(properties)), json.loads
+        )
+
+    def table_cells(self, xpath):
+        ''' Return the cells of the table selected by <xpath> (see
+            Browser.table_cells) walking its rows once in the page.
+            '''
+        if self._snapshot is not None:
+            return self._local(lambda page: page.table_cells(xpath))
+        return _then(self._request('table_cells', xpath), json.loads)
+
+    def iter_pluck(self, xpath, properties, batch_size):
+        ''' Like pluck() but retrieve the values of <batch_size>
+            elements at time so the memory used by each response, in
+            the page and here, is bounded by the batch size.
+
+            The elements are selected once, as an ordered snapshot, when
+            the iteration begins and kept in the page until the
+            iteration ends: the batches are taken by index range from
+            the same elements even if the page changes meanwhile.
+
+            The reads are not queued in a batch.
+            '''
+        _check_properties(properties)
+        if batch_size <= 0:
+            raise ValueError(
+                "The batch size must be a positive number but '{}' was received."
+                .format(batch_size)
+            )
+
+        return self._iter_pluck(xpath, properties, batch_size)
 
-        if not isinstance(properties, (list, tuple)):
-            raise TypeError(
-                "Invalid type for the property list. Expected 'list' or 'tuple' but found '{}'."
-                .format(type(properties))
+    def _iter_pluck(self, xpath, properties, batch_size):
+        if self._snapshot is not None:
+            yield from self._snapshot.page.iter_pluck(
+                xpath, properties, batch_size
             )
+            return
+
+        yield from self._iter_cursor(
+            xpath, 'fetch_rows', properties, batch_size
+        )
+
+    def iter_pluck_columns(self, xpath, properties, chunk_size):
+        ''' Like pluck_columns() but retrieve the columns of
+            <chunk_size> elements at time so the size of each response
+            is bounded (see iter_pluck()).
+            '''
+        _check_properties(properties)
+        if chunk_size <= 0:
+            raise ValueError(
+                "The chunk size must be a positive number but '{}' was received."
+                .format(chunk_size)
+            )
+
+        return self._iter_pluck_columns(xpath, properties, chunk_size)
+
+    def _iter_pluck_columns(self, xpath, properties, chunk_size):
+        if self._snapshot is not None:
+            yield from self._snapshot.page.iter_pluck_columns(
+                xpath, properties, chunk_size
+            )
+            return
+
+        for columns in self._iter_cursor(
+            xpath, 'fetch_columns', properties, chunk_size
+        ):
+            yield json.loads(columns)
+
+    def _iter_cursor(self, xpath, fetch, properties, size):
+        ''' Open a cursor on the elements selected by <xpath> and yield
+            the result of the operation <fetch> for each range of
+            <size> elements, closing the cursor at the end.
+            '''
+        cursor, count = self.run('open_cursor', xpath)
+        try:
+            for start in range(0, count, size):
+                yield self.run(
+                    fetch, None,
+                    [cursor, list(properties), start, size]
+                )
+        finally:
+            try:
+                self.run('close_cursor', None, cursor)
+            except WebDriverException:
+                pass  # the page is gone and the cursor with it
+
+    def count(self, xpath):
+        if self._snapshot is not None:
+            return self._local(lambda page: page.count(xpath))
+        return self._request('count', xpath)
+
+    def click(self, xpath, single=True):
+        ''' Click the elements selected in the page (not with
+            Selenium's WebElements), all of them in one script.
+
+            If <single> is True, exactly one element must be selected.
+
+            Return the count of elements clicked.
+            '''
+        return self._request('click', xpath, single)
+
+    def clear(self, xpath):
+        ''' Set the value of the selected elements to the empty string
+            (see set_values()) except the checkboxes and radio buttons.
+
+            Return the count of elements cleared.
+            '''
+        return self._request('clear', xpath)
+
+    def set_values(self, xpath, values, append=False):
+        ''' Set the value of the selected elements in the page,
+            dispatching the 'input' and 'change' events like if
+            the user typed them.
 
-        jscall = 'selectq.pluck(el, {properties});'.format(
-            properties=properties
+            <values> is a list of values, one per element selected,
+            or a single value for all of them.
+            A boolean value checks or unchecks the element (checkbox
+            or radio button).
+
+            If <append> is True, the values are appended to the current
+            values of the elements.
+
+            Return the count of elements modified.
+            '''
+        return self._request('set_values', xpath, [values, append])
+
+    def fill(self, fields):
+        ''' Set the value of several elements in a single script.
+            <fields> is a list of pairs (xpath, value) (see
+            set_values()).
+
+            If any xpath selects nothing, or a different count of
+            elements than values given as a list, nothing is modified.
+            '''
+        return self._request(
+            'fill', None,
+            [[self._query(xpath), value] for xpath, value in fields]
         )
 
-        return self.js_map(xpath, jscall)
+    def _request(self, kind, xpath, args=None):
+        ''' Queue the operation into the current batch if any or run
+            it immediately otherwise.
+            '''
+        if kind in _page_changing_operations:
+            self.invalidate()
+
+        if self._batch is not None:
+            return self._batch.add(kind, xpath, args)
+
+        if self._cache is not None and kind in _cacheable_operations:
+            return self._cache.run(kind, xpath, args)
+
+        return self.run(kind, xpath, args)
+
+    def wait_counts(self, conds, mode, timeout):
+        ''' Wait in the page for the conditions to hold (see
+            Browser.wait_counts).
+
+            The conditions are sent once and a MutationObserver
+            re-checks them each time that the document changes so
+            the call returns as soon as they hold, without polling.
+
+            The conditions are checked first in the same script: if
+            they already hold, the call takes a single round trip.
+
+            The script timeout of the driver is raised if it is too
+            short for the <timeout> (once: it is not restored). If it is
+            lowered behind the browser's back, the in-page wait may
+            fail.
+
+            If the in-page wait cannot complete (the driver does not
+            support async scripts, the page navigated away, ...),
+            return None so the caller can fall back to polling.
+            '''
+        driver = self.driver
+        script_timeout = timeout + _script_timeout_margin
+        try:
+            if self._script_timeout is None or \
+                    self._script_timeout < script_timeout:
+                self._driver_call(
+                    driver.set_script_timeout,
+                    script_timeout,
+                    operation='wait_count'
+                )
+                self._script_timeout = script_timeout
+
+            return self._execute(
+                _wait_all_script,
+                [[self._query(xpath), sym, cnt] for xpath, sym, cnt in conds],
+                mode,
+                int(timeout * 1000),
+                execute=driver.execute_async_script,
+                operation='wait_count',
+                xpath=conds[0][0] if len(conds) == 1 else None
+            )
+        except WebDriverException:
+            return None
+
+    def count_all(self, xpaths):
+        ''' Return the counts of the elements selected by each of the
+            <xpaths> in a single script (see batch()).
+            '''
+        with self.batch():
+            counts = [self.count(xpath) for xpath in xpaths]
+
+        return [_value_of(cnt) for cnt in counts]
+
+    @contextlib.contextmanager
+    def snapshot(self):
+        ''' Context manager that pulls the page (its HTML) once and
+            serves the reads (pluck(), count() and the Selection's
+            methods built on top of them like text()) from a local copy
+            parsed with lxml, like a FileBrowser does, instead of doing
+            a round trip per read.
+
+                with sQ.browser.snapshot():
+                    names = sQ.select('td', class_='name').text()
+                    prices = sQ.select('td', class_='price').text()
+
+            The interactions (click(), set_values(), fill(), ...),
+            get(), find_elements() (the WebElements are used to
+            interact) and the scripts (js_map(), ...) invalidate the
+            copy: the page is pulled again on the next read.
+
+            Note that the values are computed from the HTML so the
+            state that lives only in the DOM (the value typed in an
+            input, the resolved URL of a link, ...) is not available
+            and that the xpaths are evaluated from the <html> element.
+
+            Return the Snapshot; nested snapshots share it.
+            '''
+        if self._snapshot is not None:
+            yield self._snapshot
+            return
+
+        snapshot = Snapshot(self)
+        snapshot.page  # pull it now
+        self._snapshot = snapshot
+        try:
+            yield snapshot
+        finally:
+            self._snapshot = None
+
+    @contextlib.contextmanager
+    def cached(self, maxsize=256):
+        ''' Context manager that caches the results of the reads
+            (pluck(), count() and the Selection's methods built on top
+            of them like text()) keyed by the xpath, the operation and
+            its arguments (the properties).
+
+                with sQ.browser.cached() as cache:
+                    rows.expects('>=1')
+                    rows.count()                # from the cache
+                    rows.pluck('id')
+
+            The gadgets keep a version of the page: a counter of the
+            changes of the document (MutationObserver) and of the
+            values typed ('input' and 'change' events). Each read
+            sends the version of the cached result, if any, and the
+            browser evaluates the xpath only if the page changed:
+            a repeated read on an unchanged page costs a round trip
+            with a tiny response.
+
+            Note that the changes made by the page's scripts to the
+            properties that are not reflected in the document (like
+            setting an input's value) do not change the version.
+
+            The reads in a batch are not cached. Up to <maxsize>
+            results are kept. Return the ReadCache; nested blocks
+            share it.
+            '''
+        if self._cache is not None:
+            yield self._cache
+            return
+
+        cache = ReadCache(self, maxsize)
+        self._cache = cache
+        try:
+            yield cache
+        finally:
+            self._cache = None
+
+    def invalidate(self):
+        ''' Invalidate the snapshot of the page, if any: the next read
+            pulls the page again.
+            '''
+        if self._snapshot is not None:
+            self._snapshot.invalidate()
+
+    def _local(self, read):
+        ''' Call <read> with the FileBrowser of the snapshot and return
+            its result (as a Pending already done inside a batch).
+            '''
+        snapshot = self._snapshot
+        value = read(snapshot.page)
+        snapshot.reads += 1
+
+        if self._batch is not None:
+            pending = Pending(self._batch)
+            pending._resolve(value, None)
+            return pending
+
+        return value
+
+    @contextlib.contextmanager
+    def batch(self):
+        ''' Context manager that queues the reads (pluck(), count() and
+            the Selection's methods built on top of them like text())
+            and executes them all in a single script (one round trip)
+            on exit.
+
+            Inside the context, the reads return Pending objects:
+            their results are available from their 'value' attribute
+            after the context ends.
+
+                with sQ.browser.batch():
+                    ips = first_column.text()
+                    ports = next_column.text()
+                    cnt = tbl.count()
+
+                ips.value, ports.value, cnt.value
+
+            Reading a 'value' before the end executes the reads queued
+            so far. Nested batches are merged with the outer one.
+
+            The in-page interactions (click(), set_values(), fill(), ...)
+            are queued too and executed in order with the reads. Their
+            errors are raised when their 'value' is read.
+            '''
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        batch = Batch(self)
+        self._batch = batch
+        try:
+            yield batch
+            batch.flush()
+        finally:
+            self._batch = None
+
+    def _run_batch(self, requests):
+        ''' Execute the <requests> (a list of [kind, xpath, args]) in a
+            single script and return a list of [ok, result or error
+            message], one per request.
+            '''
+        requests = [
+            [kind, self._query(xpath), args] for kind, xpath, args in requests
+        ]
+        return self._execute(_run_batch_script, requests, operation='batch')
+
+    def highlight(self, xpath):
+        return self.run('highlight', xpath)
 
     def highlight_off(self):
-        xpath = '.'
-        js = 'return selectq.highlight_off();'
-        return self.js_call(xpath, js)
+        return self.run('highlight_off', None)
 
     def pprint(self, xpath):
         ''' Pretty print the html elements selected by xpath.
@@ -0,0 +1,114 @@
+import concurrent.futures
+import os
+
+from .browsers import FileBrowser, DocumentCache
+from .concurrency import iter_completed
+from .selectq import Selection
+
+# Set in each worker process by _init_worker
+_worker_browser = None
+_worker_queries = None
+
+
+def _queries_for(selections):
+    ''' Translate the <selections> of map_files() into a list of
+        (name, xpath, properties, single) that can be shipped to
+        the workers: plain strings only, no Selection nor browser.
+        '''
+    queries = []
+    for name, sel in selections.items():
+        if isinstance(sel, Selection):
+            sel, properties = sel, ('textContent', )
+        elif isinstance(sel, (list, tuple)) and sel and \
+                isinstance(sel[0], Selection):
+            sel, properties = sel[0], tuple(sel[1:])
+        else:
+            raise TypeError(
+                "Invalid selection for '{}'. Expected a Selection or a tuple (selection, property, ...) but found '{}'."
+                .format(name, type(sel))
+            )
+
+        if not properties:
+            raise ValueError(
+                "The property list for '{}' is empty.".format(name)
+            )
+
+        queries.append((name, sel.xpath, properties, len(properties) == 1))
+
+    return queries
+
+
+def _init_worker(queries, encoding, streaming):
+    global _worker_browser, _worker_queries
+
+    # each file is read once: caching or indexing the documents
+    # is pointless
+    _worker_browser = FileBrowser(
+        streaming=streaming,
+        document_cache=DocumentCache(max_bytes=0),
+        encoding=encoding,
+        indexes=False
+    )
+    _worker_queries = queries
+
+
+def _extract(path):
+    browser = _worker_browser
+    browser.get(path)
+
+    results = {}
+    for name, xpath, properties, single in _worker_queries:
+        values = browser.pluck(xpath, properties)
+        if single:
+            values = [arr[0] for arr in values]
+        results[name] = values
+
+    return results
+
+
+def map_files(
+    paths, selections, *, workers=None, encoding=None, streaming=False
+):
+    ''' Evaluate the <selections> on each file of <paths> using
+        <workers> processes in parallel (as many as CPUs by default).
+
+        The <selections> is a dictionary of names and selections: for
+        each file, the result is a dictionary with the same names and
+        the texts of the selected elements (like Selection.text()).
+        Instead of a selection, a tuple (selection, property, ...) can
+        be given to pluck those properties (like Selection.pluck()).
+
+            sQ = Selector()
+            results = map_files(paths, {
+                'titles': sQ.select('h1'),
+                'links': (sQ.select('a'), 'href', 'textContent'),
+            })
+
+        Each worker parses the files with its own FileBrowser
+        (see <encoding> and <streaming> there): only the xpaths are
+        sent to the workers, once, when they start.
+
+        Yield a tuple (path, results) as soon as each file is
+        processed (so not necessarily in the same order than <paths>).
+        If the file failed, the exception is the result.
+
+        The paths are consumed on demand so <paths> can be a
+        large (or endless) iterable.
+        '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 0:
+        raise ValueError(
+            "The number of workers must be a positive number but '{}' was received."
+            .format(workers)
+        )
+
+    queries = _queries_for(selections)
+
+    with concurrent.futures.ProcessPoolExecutor(
+        workers,
+        initializer=_init_worker,
+        initargs=(queries, encoding, streaming)
+    ) as executor:
+        yield from iter_completed(executor, _extract, paths, 2 * workers)
@@ -0,0 +1,86 @@
+import collections
+import concurrent.futures
+
+
+def iter_completed(
+    executor, fn, items, max_pending, *, key=None, per_key=1, max_held=None
+):
+    ''' Call fn(item) in the <executor> for each of the <items> and
+        yield a tuple (item, result) as soon as each call completes (so
+        not necessarily in the same order than <items>). If the call
+        raised an exception, the exception is the result.
+
+        The items are consumed on demand so <items> can be a large
+        (or endless) iterable: no more than <max_pending> calls are
+        submitted at the same time.
+
+        If <key> is given, no more than <per_key> calls for the items
+        with the same key(item) run at the same time. The rest are
+        held back, not submitted, so they do not take a worker of
+        the executor while they wait and the items that come after
+        them are not delayed. Up to <max_held> items (4 times
+        <max_pending> by default) are held back: then no more items
+        are consumed until some of them are submitted.
+        '''
+    if max_held is None:
+        max_held = 4 * max_pending
+
+    items = iter(items)
+    exhausted = False
+    pending = {}
+    held = collections.deque()
+    running = collections.Counter()
+
+    def try_submit(item):
+        if key is not None:
+            k = key(item)
+            if running[k] >= per_key:
+                return False
+            running[k] += 1
+
+        pending[executor.submit(fn, item)] = item
+        return True
+
+    try:
+        while True:
+            # the items held back go first: their keys may be free now
+            for _ in range(len(held)):
+                if len(pending) >= max_pending:
+                    break
+                item = held.popleft()
+                if not try_submit(item):
+                    held.append(item)
+
+            while not exhausted and len(pending) < max_pending and \
+                    len(held) < max_held:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                if not try_submit(item):
+                    held.append(item)
+
+            # an item is held back only while others with its key run
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for fut in done:
+                item = pending.pop(fut)
+                if key is not None:
+                    running[key(item)] -= 1
+
+                try:
+                    result = fut.result()
+                except Exception as err:
+                    result = err
+
+                yield item, result
+    finally:
+        # do not start the pending work if we are leaving early
+        for fut in pending:
+            fut.cancel()
@@ -0,0 +1,202 @@
+''' Compile simple xpaths into CSS selectors.
+
+    The browsers evaluate a CSS selector with querySelectorAll much
+    faster than an xpath with document.evaluate. Most of the selections
+    are simple chains of tags and attributes that CSS can express
+    so WebBrowser sends them as CSS instead.
+
+    >>> from selectq.css import xpath_to_css
+
+    >>> xpath_to_css(".//li[@class='cool' and @id='uniq']/a[@href]")
+    'li[class="cool"][id="uniq"] > a[href]'
+
+    >>> xpath_to_css(".//a[starts-with(@href, 'http')] | .//img[ends-with(@src, '.png')]")
+    'a[href^="http"], img[src$=".png"]'
+
+    >>> xpath_to_css("/html//li/following-sibling::li[contains(@class, 'nav')]")
+    'html:root li ~ li[class*="nav"]'
+
+    Anything else cannot be compiled (None is returned) and it is
+    evaluated as an xpath:
+
+    >>> xpath_to_css("(.//li)[1]") is None
+    True
+
+    >>> xpath_to_css(".//li[contains(text(), 'foo')]") is None
+    True
+    '''
+import functools
+import re
+
+from .xpath import _top_level
+
+_name_re = re.compile(r'(following-sibling::|child::)?([a-z][a-z0-9-]*|\*)')
+_attr_name = r'@([A-Za-z_][\w-]*)'
+_literal = r'''(?:'([^']*)'|"([^"]*)")'''
+
+_attr_exists_re = re.compile(r'^{}$'.format(_attr_name))
+_attr_equals_re = re.compile(r'^{}\s*=\s*{}$'.format(_attr_name, _literal))
+_attr_function_re = re.compile(
+    r'^(starts-with|ends-with|contains)\(\s*{}\s*,\s*{}\s*\)$'.format(
+        _attr_name, _literal
+    )
+)
+
+_css_operators = {
+    'starts-with': '^=',
+    'ends-with': '$=',
+    'contains': '*=',
+}
+
+
+@functools.lru_cache(maxsize=512)
+def xpath_to_css(xpath):
+    ''' Return the CSS selector equivalent to the <xpath> evaluated from
+        the document or None if CSS cannot express it.
+        '''
+    top = _top_level(xpath)
+    if '|' in top:
+        parts = []
+        begin = 0
+        for i, c in enumerate(top):
+            if c == '|':
+                parts.append(xpath[begin:i])
+                begin = i + 1
+        parts.append(xpath[begin:])
+
+        selectors = [xpath_to_css(part.strip()) for part in parts]
+        if None in selectors:
+            return None
+        return ', '.join(selectors)
+
+    if xpath.startswith('.//'):
+        pos, root = 3, False
+    elif xpath.startswith('//'):
+        pos, root = 2, False
+    elif xpath.startswith('/'):
+        pos, root = 1, True
+    else:
+        return None
+
+    css = []
+    while True:
+        m = _name_re.match(xpath, pos)
+        if not m:
+            return None
+
+        axis, name = m.groups()
+        pos = m.end()
+        if axis == 'following-sibling::':
+            if not css or css[-1] != ' > ':
+                return None
+            css[-1] = ' ~ '
+
+        css.append(name)
+        if root:
+            css.append(':root')
+            root = False
+
+        # the predicates
+        while pos < len(xpath) and xpath[pos] == '[':
+            end = _closing_bracket(xpath, pos)
+            if end is None:
+                return None
+
+            attrs = _predicate_to_css(xpath[pos + 1:end])
+            if attrs is None:
+                return None
+
+            css.append(attrs)
+            pos = end + 1
+
+        if pos == len(xpath):
+            return ''.join(css)
+
+        if xpath.startswith('//', pos):
+            css.append(' ')
+            pos += 2
+        elif xpath.startswith('/', pos):
+            css.append(' > ')
+            pos += 1
+        else:
+            return None
+
+
+def _closing_bracket(xpath, begin):
+    depth = 0
+    quote = None
+    for i in range(begin, len(xpath)):
+        c = xpath[i]
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+            if depth == 0:
+                return i
+
+    return None
+
+
+def _predicate_to_css(predicate):
+    ''' Translate a predicate (the conditions joined with 'and') into
+        CSS attribute selectors or return None.
+        '''
+    top = _top_level(predicate)
+    conditions = []
+    begin = 0
+    for m in re.finditer(r'\sand\s', top):
+        conditions.append(predicate[begin:m.start()])
+        begin = m.end()
+    conditions.append(predicate[begin:])
+
+    css = []
+    for cond in conditions:
+        cond = cond.strip()
+        while cond.startswith('(') and cond.endswith(')') and \
+                _top_level(cond).strip() == '':
+            cond = cond[1:-1].strip()
+
+        m = _attr_exists_re.match(cond)
+        if m:
+            css.append('[{}]'.format(m.group(1)))
+            continue
+
+        m = _attr_equals_re.match(cond)
+        if m:
+            name, value = m.group(1), _value(m.group(2), m.group(3))
+            css.append('[{}={}]'.format(name, _css_string(value)))
+            continue
+
+        m = _attr_function_re.match(cond)
+        if m:
+            func, name = m.group(1), m.group(2)
+            value = _value(m.group(3), m.group(4))
+            if not value:
+                # CSS never matches an empty prefix/suffix/substring
+                return None
+
+            css.append(
+                '[{}{}{}]'.format(
+                    name, _css_operators[func], _css_string(value)
+                )
+            )
+            continue
+
+        return None
+
+    return ''.join(css)
+
+
+def _value(single_quoted, double_quoted):
+    return single_quoted if single_quoted is not None else double_quoted
+
+
+def _css_string(value):
+    return '"{}"'.format(
+        value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\a ')
+    )
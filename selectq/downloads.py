@@ -0,0 +1,133 @@
+import concurrent.futures
+import os
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .concurrency import iter_completed
+
+
+def _filename_for(url):
+    # TODO make the file name safer
+    return url.replace(':', '').replace('/', '_')
+
+
+def _host_of(url):
+    return urllib.parse.urlsplit(url).netloc
+
+
+class Downloader:
+    ''' Download several urls concurrently.
+
+        Up to <workers> downloads run in parallel, sharing the
+        connections of a single <session> (a requests.Session; a new
+        one is created if none is given). No more than <per_host>
+        downloads go to the same host at the same time: the urls of
+        a busy host wait without taking a worker so the other hosts
+        are not delayed.
+
+        The content is streamed to disk in chunks of <chunk_size>
+        bytes so it is never held in memory. Each file is written
+        with a '.part' suffix first and renamed when the download
+        completes so a partial file is never left under the final
+        name.
+
+        <timeout> (in seconds) is the time waiting for the server
+        to connect and to send data, not the time of the whole
+        download.
+        '''
+    def __init__(
+        self,
+        session=None,
+        *,
+        workers=8,
+        per_host=2,
+        chunk_size=64 * 1024,
+        timeout=60
+    ):
+        if workers <= 0 or per_host <= 0:
+            raise ValueError(
+                "The workers and per host limits must be positive numbers but '{}' and '{}' were received."
+                .format(workers, per_host)
+            )
+
+        if session is None:
+            session = requests.Session()
+
+        # keep alive as many connections as workers we have
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        self.session = session
+        self.workers = workers
+        self.per_host = per_host
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def iter_download(self, urls, dest_folder='.'):
+        ''' Download the <urls> into the <dest_folder>.
+
+            Yield a tuple (url, filename) as soon as each download
+            completes (so not necessarily in the same order than
+            <urls>). If the download failed, the exception is returned
+            instead of the filename.
+
+            Repeated urls are downloaded once.
+            '''
+        def unique(urls):
+            seen = set()
+            for url in urls:
+                if url not in seen:
+                    seen.add(url)
+                    yield url
+
+        def fetch(url):
+            return self._fetch(
+                url, os.path.join(dest_folder, _filename_for(url))
+            )
+
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            yield from iter_completed(
+                executor,
+                fetch,
+                unique(urls),
+                2 * self.workers,
+                key=_host_of,
+                per_key=self.per_host
+            )
+
+    def download(self, urls, dest_folder='.'):
+        ''' Download the <urls> into the <dest_folder> and return the
+            filenames in the same order than the <urls>.
+
+            If any download failed, its exception is raised once all
+            the downloads finished.
+            '''
+        urls = list(urls)
+        results = dict(self.iter_download(urls, dest_folder))
+
+        for url in urls:
+            if isinstance(results[url], Exception):
+                raise results[url]
+
+        return [results[url] for url in urls]
+
+    def _fetch(self, url, fname):
+        tmpname = fname + '.part'
+        with self.session.get(url, stream=True, timeout=self.timeout) as res:
+            res.raise_for_status()
+            try:
+                with open(tmpname, 'wb') as f:
+                    for chunk in res.iter_content(self.chunk_size):
+                        f.write(chunk)
+            except BaseException:
+                try:
+                    os.remove(tmpname)
+                except OSError:
+                    pass
+                raise
+
+        os.replace(tmpname, fname)
+        return fname
@@ -64,6 +64,38 @@
         return res;
     }
 
+    // Retrieve the properties asked from the elements, one array of
+    // values per property: {property_name: [values...]}
+    function pluck_columns(elems, properties_names) {
+        var columns = {};
+        for (var j = 0; j < properties_names.length; j++) {
+            var name = properties_names[j];
+            var values = new Array(elems.length);
+            for (var i = 0; i < elems.length; i++) {
+                values[i] = elems[i][name];
+            }
+            columns[name] = values;
+        }
+        return columns;
+    }
+
+    // The cells of the rows of the table (the rows of the nested
+    // tables are not included): an array of rows, each row an array
+    // of [text, rowspan, colspan], one per cell.
+    function table_cells(table) {
+        var rows = [];
+        for (var i = 0; i < table.rows.length; i++) {
+            var cells = table.rows[i].cells;
+            var row = [];
+            for (var j = 0; j < cells.length; j++) {
+                row.push([cells[j].textContent, cells[j].rowSpan,
+                          cells[j].colSpan]);
+            }
+            rows.push(row);
+        }
+        return rows;
+    }
+
     // Click in the element selected.
     // If single is true, do not click anything if the are
     // more than one element selected (or zero).
@@ -78,6 +110,421 @@
         return true;
     }
 
+    // A query is an xpath string or an object {css: selector} for the
+    // selections that can be expressed in CSS (querySelectorAll is
+    // much faster than document.evaluate).
+    function is_css(query) {
+        return typeof query === 'object' && query !== null;
+    }
+
+    function describe(query) {
+        return is_css(query) ? query.css : query;
+    }
+
+    // Return an array with the elements selected by the xpath
+    // (in the order given by the browser).
+    function select(xpath) {
+        if (is_css(xpath))
+            return Array.prototype.slice.call(
+                        document.querySelectorAll(xpath.css));
+
+        var elems_iter = document.evaluate(xpath, document, null,
+                                    XPathResult.ANY_TYPE, null);
+        var elems = [];
+        var el = elems_iter.iterateNext();
+        while (el) {
+            elems.push(el);
+            el = elems_iter.iterateNext();
+        }
+        return elems;
+    }
+
+    // Return the elements selected by the query as an ordered snapshot:
+    // an object with the 'length' and the 'item(i)' method (a static
+    // NodeList or a snapshot XPathResult) so the elements can be taken
+    // by index without copying them into an array.
+    function select_snapshot(xpath) {
+        if (is_css(xpath))
+            return document.querySelectorAll(xpath.css);
+
+        var res = document.evaluate(xpath, document, null,
+                        XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        return {
+            length: res.snapshotLength,
+            item: function (i) { return res.snapshotItem(i); }
+        };
+    }
+
+    // Count the elements selected by the xpath without building
+    // an array of them.
+    function count(xpath) {
+        if (is_css(xpath))
+            return document.querySelectorAll(xpath.css).length;
+
+        var res = document.evaluate('count(' + xpath + ')', document, null,
+                                    XPathResult.NUMBER_TYPE, null);
+        return res.numberValue;
+    }
+
+    // Check that the count of elements is the expected.
+    function expect_count(elems, expected) {
+        if (elems.length != expected)
+            throw new Error('Unexpected count. Expected ' + expected +
+                            ' but selected ' + elems.length + '.');
+    }
+
+    function is_checkable(elem) {
+        var type = (elem.type || '').toLowerCase();
+        return type == 'checkbox' || type == 'radio';
+    }
+
+    function fire(elem, type) {
+        elem.dispatchEvent(new Event(type, {bubbles: true}));
+    }
+
+    // Set the value of the element as if the user typed it: the
+    // 'input' and 'change' events are dispatched so the scripts of
+    // the page see the change.
+    // The value is set with the setter of the element's prototype
+    // (HTMLInputElement, ...) because some frameworks override the
+    // setter of the element to track the changes made by them.
+    function set_value(elem, value) {
+        if (typeof value === 'boolean') {
+            elem.checked = value;
+        }
+        else if (elem.isContentEditable) {
+            elem.textContent = value;
+        }
+        else {
+            var proto = Object.getPrototypeOf(elem);
+            var desc = Object.getOwnPropertyDescriptor(proto, 'value');
+            if (desc && desc.set)
+                desc.set.call(elem, value);
+            else
+                elem.value = value;
+        }
+
+        fire(elem, 'input');
+        fire(elem, 'change');
+    }
+
+    // Set the values (one per element, or the same for all if
+    // 'values' is not an array). If 'append' is true, the values are
+    // appended to the current ones (like typing at the end).
+    function set_values(elems, values, append) {
+        if (Array.isArray(values))
+            expect_count(elems, values.length);
+
+        for (var i = 0; i < elems.length; i++) {
+            var value = Array.isArray(values) ? values[i] : values;
+            if (append)
+                value = (elems[i].isContentEditable ?
+                            elems[i].textContent : elems[i].value) + value;
+            set_value(elems[i], value);
+        }
+        return elems.length;
+    }
+
+    var comparators = {
+        '==': function (a, b) { return a == b; },
+        '!=': function (a, b) { return a != b; },
+        '>': function (a, b) { return a > b; },
+        '>=': function (a, b) { return a >= b; },
+        '<': function (a, b) { return a < b; },
+        '<=': function (a, b) { return a <= b; },
+    };
+
+    // Wait until the conditions hold: all of them if 'mode' is 'all'
+    // or any of them if it is 'any'. Each condition is an array
+    // [xpath, sym, cnt]: the count of the elements selected by the
+    // xpath compared with 'cnt' by the operator 'sym'.
+    // The conditions are checked once and then re-checked only when
+    // the document changes (MutationObserver) or until 'timeout_ms'
+    // milliseconds elapsed. The outcome of each condition (an array
+    // of true or false) is passed to 'done' (the callback of an
+    // async script).
+    function wait_for_all(conds, mode, timeout_ms, done) {
+        if (mode !== 'all' && mode !== 'any')
+            throw new Error("Unknown mode '" + mode + "'.");
+
+        var cmps = [];
+        for (var i = 0; i < conds.length; i++) {
+            var cmp = comparators[conds[i][1]];
+            if (typeof cmp === 'undefined')
+                throw new Error("Unknown operator '" + conds[i][1] + "'.");
+            cmps.push(cmp);
+        }
+
+        function states() {
+            var res = [];
+            for (var i = 0; i < conds.length; i++) {
+                res.push(cmps[i](count(conds[i][0]), conds[i][2]));
+            }
+            return res;
+        }
+
+        function holds(st) {
+            for (var i = 0; i < st.length; i++) {
+                if (st[i] && mode === 'any')
+                    return true;
+                if (!st[i] && mode === 'all')
+                    return false;
+            }
+            return mode === 'all';
+        }
+
+        var st = states();
+        if (holds(st)) {
+            done(st);
+            return;
+        }
+
+        var finished = false;
+        var timer = null;
+        var observer = null;
+
+        function finish(st) {
+            if (finished)
+                return;
+            finished = true;
+            observer.disconnect();
+            clearTimeout(timer);
+            done(st);
+        }
+
+        // the mutations are delivered in batches so the xpaths are
+        // evaluated once per batch, not once per mutation
+        observer = new MutationObserver(function () {
+            var st = states();
+            if (holds(st))
+                finish(st);
+        });
+        observer.observe(document, {
+            childList: true,
+            subtree: true,
+            attributes: true,
+            characterData: true
+        });
+
+        timer = setTimeout(function () { finish(states()); }, timeout_ms);
+    }
+
+    // Wait until the count of the elements selected by the xpath
+    // compared with 'cnt' by the operator 'sym' holds or until
+    // 'timeout_ms' milliseconds elapsed (see wait_for_all).
+    // The outcome (true or false) is passed to 'done'.
+    function wait_for(xpath, sym, cnt, timeout_ms, done) {
+        wait_for_all([[xpath, sym, cnt]], 'all', timeout_ms,
+                     function (st) { done(st[0]); });
+    }
+
+    // The elements selected when a cursor was opened (an ordered
+    // snapshot, see select_snapshot), by cursor id, so they can be
+    // retrieved in chunks without selecting them again.
+    var cursors = {};
+    var next_cursor_id = 1;
+
+    function cursor_of(id) {
+        var cursor = cursors[id];
+        if (typeof cursor === 'undefined')
+            throw new Error("Unknown cursor '" + id + "' (closed or " +
+                            "the page was reloaded).");
+        return cursor;
+    }
+
+    // Return an array with the elements of the cursor from the index
+    // 'start' (up to 'size' elements).
+    function cursor_range(id, start, size) {
+        var snapshot = cursor_of(id);
+        var end = Math.min(start + size, snapshot.length);
+        var elems = [];
+        for (var i = start; i < end; i++) {
+            elems.push(snapshot.item(i));
+        }
+        return elems;
+    }
+
+    // The operations that can be executed with run(): each one
+    // receives the xpath and the arguments of the operation.
+    var operations = {
+        count: function (xpath, args) {
+            return count(xpath);
+        },
+        pluck: function (xpath, properties_names) {
+            var elems = select(xpath);
+            var res = [];
+            for (var i = 0; i < elems.length; i++) {
+                res.push(pluck(elems[i], properties_names));
+            }
+            return res;
+        },
+        // The values are returned as a single JSON string: the driver
+        // transfers one string much faster than an array of arrays.
+        pluck_columns: function (xpath, properties_names) {
+            return JSON.stringify(
+                        pluck_columns(select(xpath), properties_names));
+        },
+        table_cells: function (xpath, args) {
+            var elems = select(xpath);
+            expect_count(elems, 1);
+            return JSON.stringify(table_cells(elems[0]));
+        },
+        // Select the elements once and keep them: return the cursor id
+        // and the count of elements selected.
+        open_cursor: function (xpath, args) {
+            var id = next_cursor_id++;
+            cursors[id] = select_snapshot(xpath);
+            return [id, cursors[id].length];
+        },
+        // Pluck the properties of the elements of the cursor in the
+        // index range [start, start + size);
+        // args: [id, properties_names, start, size]
+        fetch_rows: function (xpath, args) {
+            var elems = cursor_range(args[0], args[2], args[3]);
+            var res = [];
+            for (var i = 0; i < elems.length; i++) {
+                res.push(pluck(elems[i], args[1]));
+            }
+            return res;
+        },
+        // Like fetch_rows but return the values by property
+        // (see pluck_columns)
+        fetch_columns: function (xpath, args) {
+            var elems = cursor_range(args[0], args[2], args[3]);
+            return JSON.stringify(pluck_columns(elems, args[1]));
+        },
+        close_cursor: function (xpath, id) {
+            delete cursors[id];
+            return null;
+        },
+        click: function (xpath, single) {
+            var elems = select(xpath);
+            if (single)
+                expect_count(elems, 1);
+
+            click(elems, false);
+            return elems.length;
+        },
+        // The checkboxes and radio buttons are left as they are:
+        // their value is not what the user types but what the form
+        // sends if they are checked.
+        clear: function (xpath, args) {
+            var elems = select(xpath).filter(function (elem) {
+                return !is_checkable(elem);
+            });
+            return set_values(elems, '', false);
+        },
+        set_values: function (xpath, args) {
+            // args: [values, append]
+            return set_values(select(xpath), args[0], args[1]);
+        },
+        // Set the values of several fields, 'fields' is an array of
+        // [xpath, value]. All the xpaths are evaluated (and the count
+        // of elements checked against the values given as an array)
+        // before setting any value so a form is not left half filled
+        // if one of them is wrong.
+        fill: function (xpath, fields) {
+            var all_elems = [];
+            for (var i = 0; i < fields.length; i++) {
+                var elems = select(fields[i][0]);
+                if (elems.length == 0)
+                    throw new Error("Nothing selected by '" +
+                                    describe(fields[i][0]) + "'.");
+                if (Array.isArray(fields[i][1]) &&
+                        elems.length != fields[i][1].length)
+                    throw new Error('Unexpected count. Expected ' +
+                                    fields[i][1].length + ' but selected ' +
+                                    elems.length + " by '" +
+                                    describe(fields[i][0]) + "'.");
+                all_elems.push(elems);
+            }
+
+            for (var i = 0; i < fields.length; i++) {
+                set_values(all_elems[i], fields[i][1], false);
+            }
+            return fields.length;
+        },
+        highlight: function (xpath, args) {
+            return highlight(select(xpath));
+        },
+        highlight_off: function (xpath, args) {
+            return highlight_off();
+        },
+    };
+
+    // Execute the operation named 'kind' over the elements selected
+    // by the xpath.
+    function run(kind, xpath, args) {
+        var op = operations[kind];
+        if (typeof op === 'undefined')
+            throw new Error("Unknown selectq operation '" + kind + "'.");
+
+        return op(xpath, args);
+    }
+
+    // The version of the page: a token that identifies this page (the
+    // gadgets are loaded again in a new page) and a counter of the
+    // changes of the document. The changes are tracked with
+    // a MutationObserver (plus the 'input' and 'change' events for the
+    // values typed) started the first time that the version is asked.
+    var page_token = Math.random().toString(36).slice(2);
+    var changes = 0;
+    var changes_observer = null;
+
+    function count_change() {
+        changes++;
+    }
+
+    function page_version() {
+        if (changes_observer === null) {
+            changes_observer = new MutationObserver(count_change);
+            changes_observer.observe(document, {
+                childList: true,
+                subtree: true,
+                attributes: true,
+                characterData: true
+            });
+            document.addEventListener('input', count_change, true);
+            document.addEventListener('change', count_change, true);
+        }
+
+        // the changes not delivered to the observer yet
+        if (changes_observer.takeRecords().length > 0)
+            changes++;
+
+        return [page_token, changes];
+    }
+
+    // Execute the operation unless the page is still in the given
+    // version (the caller has the result from then).
+    // Return [current version, true, null] if the page did not change
+    // or [current version, false, result] otherwise.
+    function run_cached(version, kind, xpath, args) {
+        var current = page_version();
+        if (version !== null && version[0] === current[0] &&
+                version[1] === current[1])
+            return [current, true, null];
+
+        return [current, false, run(kind, xpath, args)];
+    }
+
+    // Execute several operations, each one described by an array
+    // [kind, xpath, args].
+    // Return an array with [true, result] for each operation or
+    // [false, error message] for the failed ones.
+    function run_batch(requests) {
+        var results = [];
+        for (var i = 0; i < requests.length; i++) {
+            try {
+                results.push([true, run.apply(null, requests[i])]);
+            }
+            catch (err) {
+                results.push([false, String(err)]);
+            }
+        }
+        return results;
+    }
+
 
     if (typeof ctx.selectq === 'undefined')
         ctx.selectq = {};
@@ -85,8 +532,18 @@
     ctx.selectq.highlight = highlight;
     ctx.selectq.highlight_off = highlight_off;
     ctx.selectq.pluck = pluck;
+    ctx.selectq.pluck_columns = pluck_columns;
     ctx.selectq.click = click;
+    ctx.selectq.set_value = set_value;
     ctx.selectq.add_class = add_class;
     ctx.selectq.remove_class = remove_class;
+    ctx.selectq.select = select;
+    ctx.selectq.count = count;
+    ctx.selectq.wait_for = wait_for;
+    ctx.selectq.wait_for_all = wait_for_all;
+    ctx.selectq.run = run;
+    ctx.selectq.run_batch = run_batch;
+    ctx.selectq.page_version = page_version;
+    ctx.selectq.run_cached = run_cached;
 }(window));
 
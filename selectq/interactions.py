@@ -1,14 +1,15 @@
-import json
 import requests
-import os.path
+import collections
+import math
 import operator
+from .browsers import _then, _value_of
+from .downloads import Downloader
 
 
 class InteractionMixin:
     def highlight(self):
         ''' Modify the elements selected to highlight them. '''
-        js = 'return selectq.highlight(elems);'
-        return self.browser.js_call(self.xpath, js)
+        return self.browser.highlight(self.xpath)
 
     # TODO support for 'foo.bar.baz' properties and for 'invoking' methods
     def pluck(self, *properties):
@@ -34,18 +35,125 @@ class InteractionMixin:
 
         is_single_prop = len(properties) == 1
 
-        properties = json.dumps(properties)
-        jscall = 'selectq.pluck(el, {properties});'.format(
-            properties=properties
-        )
-        results = self.browser.js_map(self.xpath, jscall)
+        results = self.browser.pluck(self.xpath, properties)
 
         if is_single_prop:
-            return [arr[0] for arr in results]
+            return _then(results, lambda results: [arr[0] for arr in results])
 
         return results
 
-    def click(self, single=True):
+    def iter_pluck(self, *properties, batch_size=500):
+        ''' Like pluck() but retrieve the values incrementally, yielding
+            lists (batches) of at most <batch_size> values.
+
+            How much is kept in memory depends on the browser: a
+            streaming FileBrowser, for example, keeps only a batch and
+            a WebBrowser retrieves a batch per round trip.
+
+                for hrefs in sQ.select('a').iter_pluck('href'):
+                    ...
+            '''
+        if not properties:
+            raise ValueError('The property list is empty.')
+
+        if batch_size <= 0:
+            raise ValueError(
+                "The batch size must be a positive number but '{}' was received."
+                .format(batch_size)
+            )
+
+        # the arguments are checked above, not when the iteration begins
+        return self._iter_pluck(properties, batch_size)
+
+    def _iter_pluck(self, properties, batch_size):
+        is_single_prop = len(properties) == 1
+
+        for batch in self.browser.iter_pluck(
+            self.xpath, properties, batch_size
+        ):
+            if is_single_prop:
+                yield [arr[0] for arr in batch]
+            else:
+                yield batch
+
+    def pluck_columns(self, *properties, types=None, numpy=False):
+        ''' Like pluck() but return the values by property: a dictionary
+            of the <properties> and the list of their values, one value
+            per element selected.
+
+            The values can be converted with <types>, a dictionary of
+            property names and a type (like int or float) or a single
+            type for all of them. None values are kept as they are.
+
+            If <numpy> is True, the columns are returned as NumPy arrays
+            (of the <types> given, if any).
+            '''
+        if not properties:
+            raise ValueError('The property list is empty.')
+
+        return _then(
+            self.browser.pluck_columns(self.xpath, properties),
+            lambda columns: _convert_columns(columns, types, numpy)
+        )
+
+    def iter_pluck_columns(
+        self, *properties, chunk_size=5000, types=None, numpy=False
+    ):
+        ''' Like pluck_columns() but retrieve the values incrementally,
+            yielding the columns of at most <chunk_size> elements
+            each time.
+            '''
+        if not properties:
+            raise ValueError('The property list is empty.')
+
+        if chunk_size <= 0:
+            raise ValueError(
+                "The chunk size must be a positive number but '{}' was received."
+                .format(chunk_size)
+            )
+
+        # the arguments are checked above, not when the iteration begins
+        return self._iter_pluck_columns(properties, chunk_size, types, numpy)
+
+    def _iter_pluck_columns(self, properties, chunk_size, types, numpy):
+        for columns in self.browser.iter_pluck_columns(
+            self.xpath, properties, chunk_size
+        ):
+            yield _convert_columns(columns, types, numpy)
+
+    def table(self, header=True, columns=None, orient='records'):
+        ''' Extract the data of the selected table (exactly one table
+            must be selected) walking its rows and cells once.
+
+            The cells that span several rows or columns (rowspan and
+            colspan) are repeated in each row and column that they
+            span so the rows are aligned; a missing cell is None.
+            The text of each cell has its whitespace collapsed.
+
+            If <header> is True, the first row has the names of the
+            columns; if False, the columns are numbered from 0. A list
+            of names can be given instead. Repeated names get a suffix
+            ('.1', '.2', ...).
+
+            <columns> is a list of the names of the columns to extract,
+            all of them by default.
+
+            If <orient> is 'records', return a list with a dictionary
+            per row; if 'columns', a dictionary with a list of values
+            per column.
+            '''
+        if orient not in ('records', 'columns'):
+            raise ValueError(
+                "Invalid orient '{}'. Expected 'records' or 'columns'.".
+                format(orient)
+            )
+
+        return _then(
+            self.browser.table_cells(self.xpath),
+            lambda cells: _table(cells, header, columns, orient)
+        )
+
+    def click(self, single=True, native=True):
         ''' Click in the selected Selenium WebElement.
 
             Click in a single element selected. If no element was
@@ -54,25 +162,26 @@ class InteractionMixin:
 
             If <single> is False, the restriction is relaxed: all
             the elements selected (zero, one or more) will be clicked.
-            '''
 
-        if False:
-            js = 'return selectq.click(elems, {});'.format(str(single).lower())
-            return self.browser.js_call(self.xpath, js)
+            If <native> is False, the elements are clicked by javascript
+            in the page, all of them in a single script, instead of
+            by Selenium one by one. Note that the events dispatched
+            by javascript are not 'trusted' and some sites ignore them.
+            '''
+        if not native:
+            return self.browser.click(self.xpath, single)
 
-        if True:
-            elems = self.web_elements()
-            elem_cnt = len(elems)
-            if single and elem_cnt != 1:
-                raise Exception(
-                    'Unexpected count. Expected 1 but selected {}.'.
-                    format(elem_cnt)
-                )
+        elems = self.web_elements()
+        elem_cnt = len(elems)
+        if single and elem_cnt != 1:
+            raise Exception(
+                'Unexpected count. Expected 1 but selected {}.'.
+                format(elem_cnt)
+            )
 
-            for el in elems:
-                el.click()
+        self._each_element(elems, lambda i, el: el.click())
 
-    def send_keys(self, values):
+    def send_keys(self, values, native=True):
         ''' Send keys to the selected elements.
 
             <values> can be a single string in which case the selected
@@ -83,7 +192,17 @@ class InteractionMixin:
             count of <values>.
 
             Each string then will be send to each WebElement.
+
+            If <native> is False, the strings are appended to the values
+            of the elements by javascript in a single script (see
+            set_value()). Special keys (Keys.ENTER, ...) are not
+            supported in this mode.
             '''
+        if not native:
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            return self.browser.set_values(self.xpath, list(values), True)
+
         elems = self.web_elements()
         elem_cnt = len(elems)
         if isinstance(values, (list, tuple)):
@@ -91,26 +210,71 @@ class InteractionMixin:
             if elem_cnt != val_cnt:
                 raise Exception()
 
-            for el, val in zip(elems, values):
-                el.send_keys(val)
+            self._each_element(elems, lambda i, el: el.send_keys(values[i]))
         else:
             if elem_cnt != 1:
                 raise Exception()
 
-            elems[0].send_keys(values)
+            self._each_element(elems, lambda i, el: el.send_keys(values))
 
-    def clear(self):
+    def clear(self, native=True):
         ''' Clear the selected elements. Use this to clear a text input
             for example.
+
+            If <native> is False, the elements are cleared by javascript
+            in a single script (see set_value()). The checkboxes and
+            radio buttons are left as they are then.
             '''
-        elems = self.web_elements()
-        for el in elems:
-            el.clear()
+        if not native:
+            self.browser.clear(self.xpath)
+        else:
+            elems = self.web_elements()
+            self._each_element(elems, lambda i, el: el.clear())
 
         # Return self to support sQ(...).clear().send_keys(...)
         # (aka clear and set a new text)
         return self
 
+    def set_value(self, values):
+        ''' Set the value of the selected elements by javascript, all
+            of them in a single script. The 'input' and 'change' events
+            are dispatched so the page sees the change like if the user
+            typed it.
+
+            <values> can be a list with one value per selected element
+            or a single value for all of them. A boolean value
+            checks/unchecks a checkbox or radio button.
+            '''
+        if isinstance(values, tuple):
+            values = list(values)
+        return self.browser.set_values(self.xpath, values)
+
+    def fill(self, fields):
+        ''' Set the values of several selections in a single script
+            (see set_value()).
+
+            <fields> is a dictionary (or a list of pairs) that maps
+            each selection to its value:
+
+                sQ.fill({
+                    sQ.select('input', name='user'): 'john',
+                    sQ.select('input', name='remember'): True,
+                })
+
+            If any selection selects nothing, or if a list of values
+            does not have one value per selected element, no value is
+            set.
+            '''
+        if hasattr(fields, 'items'):
+            fields = fields.items()
+
+        return self.browser.fill([(sel.xpath, value) for sel, value in fields])
+
+    def _each_element(self, elems, action):
+        ''' Call action(i, el) for each WebElement <el> of <elems>. '''
+        for i, el in enumerate(elems):
+            action(i, el)
+
     def web_elements(self):
         ''' Retrieve the Selenium WebElements found by the current selection.
 
@@ -118,47 +282,54 @@ class InteractionMixin:
             with a WebElement may end in an error (exception) if the element
             is not available after the selection.
             '''
-        return self.browser.driver.find_elements('xpath', self.xpath)
+        return self.browser.find_elements(self.xpath)
 
-    def download(self, dest_folder='.'):
+    def download(self, dest_folder='.', *, workers=8, per_host=2):
         ''' Pluck the href or src attributes of the selected elements
             and download the content of those urls and save them in
             the given destination folder.
 
+            Return the names of the files saved.
+
+            Up to <workers> downloads run in parallel, no more than
+            <per_host> to the same host. See Downloader.
+
             '''
-        # "copy" the selenium's session into the requests' session
-        cookies = self.browser.driver.get_cookies()
-        s = requests.Session()
-        for c in cookies:
-            # TODO add more things? https://github.com/tryolabs/requestium/blob/9533932ae688da26f3fb78b97b3c0b05c6f24934/requestium/requestium.py#L111-L114
-            s.cookies.set(c['name'], c['value'], domain=c['domain'])
+        return self._downloader(workers, per_host
+                                ).download(self._download_urls(), dest_folder)
 
-        # TODO add more things like proxy? host?
-        user_agent = self.browser.driver.execute_script(
-            "return navigator.userAgent;"
+    def iter_download(self, dest_folder='.', *, workers=8, per_host=2):
+        ''' Like download() but yield a tuple (url, filename) as soon
+            as each download completes. If a download failed, the
+            exception is returned instead of the filename.
+            '''
+        return self._downloader(workers, per_host).iter_download(
+            self._download_urls(), dest_folder
         )
-        s.headers.update({'user-agent': user_agent})
 
+    def _download_urls(self):
         urls = [
-            href if href else src for href, src in self.pluck('href', 'src')
+            href if href else src
+            for href, src in _value_of(self.pluck('href', 'src'))
         ]
-        fnames = []
-        for url in urls:
-            if not url:
-                continue
-
-            res = s.get(url)
-            # TODO make the file name safer
-            fname = os.path.join(
-                dest_folder,
-                url.replace(':', '').replace('/', '_')
-            )
-            with open(fname, 'wb') as f:
-                f.write(res.content)
+        return [url for url in urls if url]
 
-            fnames.append(fname)
+    def _downloader(self, workers, per_host):
+        s = requests.Session()
 
-        return fnames
+        driver = getattr(self.browser, 'driver', None)
+        if driver is not None:
+            # "copy" the selenium's session into the requests' session
+            cookies = driver.get_cookies()
+            for c in cookies:
+                # TODO add more things? https://github.com/tryolabs/requestium/blob/9533932ae688da26f3fb78b97b3c0b05c6f24934/requestium/requestium.py#L111-L114
+                s.cookies.set(c['name'], c['value'], domain=c['domain'])
+
+            # TODO add more things like proxy? host?
+            user_agent = driver.execute_script("return navigator.userAgent;")
+            s.headers.update({'user-agent': user_agent})
+
+        return Downloader(s, workers=workers, per_host=per_host)
 
     def text(self, inner=False):
         ''' Return all the text elements inside the selected nodes
@@ -172,6 +343,14 @@ class InteractionMixin:
         '''
         return self.pluck('innerText' if inner else 'textContent')
 
+    def iter_text(self, inner=False, batch_size=500):
+        ''' Like text() but retrieve the texts incrementally.
+            See iter_pluck().
+            '''
+        return self.iter_pluck(
+            'innerText' if inner else 'textContent', batch_size=batch_size
+        )
+
     def html(self):
         return self.pluck('outerHTML')
 
@@ -186,7 +365,7 @@ class InteractionMixin:
             You can change them if needed.
         '''
         ret = []
-        for tag, *vals in self.pluck('tagName', *props):
+        for tag, *vals in _value_of(self.pluck('tagName', *props)):
             desc = [f"tag: {tag}"]
             for p, v in zip(props, vals):
                 if not v:
@@ -202,11 +381,10 @@ class InteractionMixin:
         print('\n'.join(ret))
 
     def count(self):
-        jscall = 'return elems.length;'
-        return self.browser.js_call(self.xpath, jscall)
+        return self.browser.count(self.xpath)
 
     def expects(self, expected_count):
-        cnt = self.count()
+        cnt = _value_of(self.count())
 
         if isinstance(expected_count, int):
             is_good = cnt == expected_count
@@ -259,3 +437,111 @@ class InteractionMixin:
             )
 
         return self
+
+
+def _convert_columns(columns, types, numpy):
+    ''' Convert the values of the <columns> to the <types> (a type
+        or a dictionary of property names and types) and to NumPy
+        arrays if <numpy> is True.
+        '''
+    if types is not None and not isinstance(types, dict):
+        types = {prop: types for prop in columns}
+
+    types = types or {}
+    unknown = [prop for prop in types if prop not in columns]
+    if unknown:
+        raise ValueError(
+            "Types given for properties not plucked: {}. The properties plucked are {}."
+            .format(
+                ', '.join(repr(p) for p in unknown),
+                ', '.join(repr(p) for p in columns)
+            )
+        )
+
+    if numpy:
+        import numpy as np
+        return {
+            prop: np.array(values, dtype=types.get(prop))
+            for prop, values in columns.items()
+        }
+
+    for prop, convert in types.items():
+        values = columns[prop]
+        columns[prop] = [None if v is None else convert(v) for v in values]
+
+    return columns
+
+
+def _table_grid(rows):
+    ''' Place the cells of the <rows> (lists of [text, rowspan,
+        colspan]) in a grid repeating the cells that span several rows
+        or columns. A rowspan of 0 spans until the end of the table.
+        '''
+    grid = []
+    spans = {}  # column: [rows left, text] of the cells from above
+    for row in rows:
+        line = {col: text for col, (_, text) in spans.items()}
+        spans = {
+            col: [left - 1, text]
+            for col, (left, text) in spans.items() if left > 1
+        }
+
+        col = 0
+        for text, rowspan, colspan in row:
+            while col in line:
+                col += 1
+
+            text = ' '.join(text.split())
+            for _ in range(max(colspan, 1)):
+                line[col] = text
+                if rowspan != 1:
+                    spans[col] = [rowspan - 1 if rowspan else math.inf, text]
+                col += 1
+
+        width = max(line) + 1 if line else 0
+        grid.append([line.get(col) for col in range(width)])
+
+    width = max((len(row) for row in grid), default=0)
+    return [row + [None] * (width - len(row)) for row in grid]
+
+
+def _table(cells, header, columns, orient):
+    grid = _table_grid(cells)
+    if header is True:
+        names, grid = (grid[0], grid[1:]) if grid else ([], [])
+        names = [i if name is None else name for i, name in enumerate(names)]
+    elif not header:
+        names = list(range(len(grid[0]) if grid else 0))
+    else:
+        names = list(header)
+
+    # repeated names get a suffix: 'Header', 'Header.1', ...
+    seen = collections.Counter()
+    unique = []
+    for name in names:
+        unique.append(
+            name if not seen[name] else '{}.{}'.format(name, seen[name])
+        )
+        seen[name] += 1
+    names = unique
+
+    if columns is None:
+        columns = names
+
+    index = {name: i for i, name in enumerate(names)}
+    for name in columns:
+        if name not in index:
+            raise ValueError(
+                "Unknown column '{}'. The columns are: {}".format(
+                    name, ', '.join(map(repr, names))
+                )
+            )
+
+    def value(row, name):
+        i = index[name]
+        return row[i] if i < len(row) else None
+
+    if orient == 'columns':
+        return {name: [value(row, name) for row in grid] for name in columns}
+
+    return [{name: value(row, name) for name in columns} for row in grid]
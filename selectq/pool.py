@@ -0,0 +1,219 @@
+import concurrent.futures
+import contextlib
+import functools
+import queue
+import threading
+
+from .concurrency import iter_completed
+from .selectq import Selector
+from .shortcuts import _new_driver
+
+
+class BrowserPool:
+    ''' Pool of browsers to scrape several pages in parallel.
+
+        Up to <size> browsers of <browser_type> are started on demand
+        with the same parameters than open_browser() (<headless>,
+        <proxy_conf>, <executable_path>, ...).
+
+        Instead of a <browser_type>, a <factory> can be given: a callable
+        that returns a new browser (a Selenium's WebDriver or a selectq's
+        Browser like FileBrowser).
+
+        Each browser is used by one thread at time through a Selector
+        bound to it: map() runs an extraction function over a list of
+        urls, selector() lends a Selector for ad hoc work.
+
+        If an extraction fails and the browser is found dead (crashed),
+        the browser is restarted and the url retried up to <retries>
+        times.
+
+        The pool must be closed with close() to quit the browsers;
+        it can be used as a context manager to do that automatically.
+        '''
+    def __init__(
+        self,
+        browser_type=None,
+        size=4,
+        *,
+        factory=None,
+        retries=1,
+        **browser_kargs
+    ):
+        if size <= 0:
+            raise ValueError(
+                "The pool size must be a positive number but '{}' was received."
+                .format(size)
+            )
+
+        if factory is None:
+            if browser_type is None:
+                raise ValueError(
+                    "Either a browser type or a browser factory is required."
+                )
+            factory = functools.partial(
+                _new_driver, browser_type, **browser_kargs
+            )
+        elif browser_type is not None or browser_kargs:
+            raise ValueError(
+                "The browser type and its parameters cannot be used with a factory."
+            )
+
+        self.size = size
+        self.retries = retries
+        self._factory = factory
+
+        self._idle = queue.Queue()
+        self._selectors = []
+        self._started = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+        self.restarts = 0
+
+    def acquire(self):
+        ''' Return a Selector bound to an idle browser.
+
+            If there is none, start a new browser if the pool is not
+            full or wait for one otherwise.
+
+            The Selector must be given back with release().
+            '''
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._closed:
+                raise Exception("The pool is closed.")
+
+            start = self._started < self.size
+            if start:
+                self._started += 1
+
+        if start:
+            return self._start()
+
+        return self._idle.get()
+
+    def release(self, sQ):
+        ''' Give back a Selector obtained from acquire(). '''
+        self._idle.put(sQ)
+
+    @contextlib.contextmanager
+    def selector(self):
+        ''' Context manager that lends a Selector bound to an idle
+            browser of the pool.
+
+                with pool.selector() as sQ:
+                    sQ.browser.get(url)
+                    ...
+            '''
+        sQ = self.acquire()
+        try:
+            yield sQ
+        finally:
+            self.release(sQ)
+
+    def map(self, fn, urls):
+        ''' Open each url of <urls> in a browser of the pool and call
+            fn(sQ) where sQ is a Selector bound to that browser.
+
+            Yield a tuple (url, result) as soon as each extraction
+            completes (so not necessarily in the same order than
+            <urls>). If fn raised an exception, the exception is the
+            result.
+
+            The urls are consumed on demand so <urls> can be a
+            large (or endless) iterable.
+            '''
+        with concurrent.futures.ThreadPoolExecutor(self.size) as executor:
+            yield from iter_completed(
+                executor, functools.partial(self._scrape, fn), urls,
+                2 * self.size
+            )
+
+    def close(self):
+        ''' Quit all the browsers of the pool. '''
+        with self._lock:
+            self._closed = True
+            selectors, self._selectors = self._selectors, []
+
+        for sQ in selectors:
+            _quit_browser(sQ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _start(self):
+        ''' Start a new browser. The caller must have reserved a place
+            for it incrementing _started.
+            '''
+        try:
+            sQ = Selector(self._factory())
+        except BaseException:
+            with self._lock:
+                self._started -= 1
+            raise
+
+        with self._lock:
+            self._selectors.append(sQ)
+        return sQ
+
+    def _restart(self, sQ):
+        ''' Quit the browser of <sQ> and start a new one in its place. '''
+        with self._lock:
+            # compare by identity: Selection's == builds a condition
+            self._selectors = [s for s in self._selectors if s is not sQ]
+            self.restarts += 1
+
+        _quit_browser(sQ)
+        return self._start()
+
+    def _scrape(self, fn, url):
+        sQ = self.acquire()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    sQ.browser.get(url)
+                    return fn(sQ)
+                except Exception:
+                    if attempt >= self.retries or _is_alive(sQ):
+                        raise
+
+                attempt += 1
+                dead, sQ = sQ, None
+                sQ = self._restart(dead)
+        finally:
+            if sQ is not None:
+                self.release(sQ)
+
+
+def _is_alive(sQ):
+    ''' Check if the browser bound to the selector still responds. '''
+    driver = getattr(sQ.browser, 'driver', None)
+    if driver is None:
+        return True  # not a real browser, it cannot crash
+
+    try:
+        driver.current_url
+    except Exception:
+        return False
+
+    return True
+
+
+def _quit_browser(sQ):
+    quit = getattr(sQ.browser, 'quit', None)
+    if quit is None:
+        return
+
+    try:
+        quit()
+    except Exception:
+        pass  # it may be already dead
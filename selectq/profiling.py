@@ -0,0 +1,158 @@
+import bisect
+import collections
+import json
+import sys
+
+# A command sent to the driver:
+#  - command: the driver's command ('w3cExecuteScript', 'findElements',
+#    'clickElement', ...)
+#  - method: the Selection's method that caused it (None if the browser
+#    was called directly)
+#  - operation: what the command did ('pluck', 'count', 'batch', ...)
+#  - xpath: the xpath of the selection, if any
+#  - sent, received: approximate size of the payloads in bytes
+#  - seconds: wall time of the command
+#  - error: the exception raised, if any
+Command = collections.namedtuple(
+    'Command', [
+        'command', 'method', 'operation', 'xpath', 'sent', 'received',
+        'seconds', 'error'
+    ]
+)
+
+# upper bounds (in seconds) of the buckets of the latency histograms
+_latency_buckets = (
+    0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5,
+    float('inf')
+)
+
+
+class Profile:
+    ''' Record of the commands sent to the driver while the profile
+        is active (see WebBrowser.profile()).
+
+        Each command is recorded as a Command in the 'commands' list
+        and passed to each of the <hooks> (callables) as soon as it
+        completes so they can be exported to other systems.
+        '''
+    def __init__(self, hooks=()):
+        self.commands = []
+        self.hooks = list(hooks)
+
+    def record(self, command):
+        self.commands.append(command)
+        for hook in self.hooks:
+            hook(command)
+
+    def summary(self, by='method'):
+        ''' Aggregate the commands by the field <by> ('method',
+            'operation', 'command' or 'xpath').
+
+            Return a dictionary with the count of commands ('calls'),
+            the bytes 'sent' and 'received', the 'total' and 'max'
+            times and the 'errors' of each group.
+            '''
+        groups = {}
+        for cmd in self.commands:
+            key = getattr(cmd, by)
+            g = groups.get(key)
+            if g is None:
+                g = groups[key] = {
+                    'calls': 0,
+                    'sent': 0,
+                    'received': 0,
+                    'total': 0.0,
+                    'max': 0.0,
+                    'errors': 0,
+                }
+
+            g['calls'] += 1
+            g['sent'] += cmd.sent
+            g['received'] += cmd.received
+            g['total'] += cmd.seconds
+            g['max'] = max(g['max'], cmd.seconds)
+            g['errors'] += cmd.error is not None
+
+        return groups
+
+    def histogram(self, **filters):
+        ''' Return the latency histogram of the commands: a list of
+            (upper bound in seconds, count) pairs.
+
+            Only the commands that have the values given in <filters>
+            are counted:
+
+                profile.histogram(method='text')
+            '''
+        counts = [0] * len(_latency_buckets)
+        for cmd in self.commands:
+            if all(getattr(cmd, k) == v for k, v in filters.items()):
+                counts[bisect.bisect_left(_latency_buckets, cmd.seconds)] += 1
+
+        return list(zip(_latency_buckets, counts))
+
+    def report(self, by='method'):
+        ''' Return a printable report with the summary (see summary())
+            and the latency histogram of all the commands.
+            '''
+        lines = [
+            '{:<24} {:>6} {:>10} {:>10} {:>10} {:>10} {:>6}'.format(
+                by, 'calls', 'sent', 'received', 'total ms', 'max ms', 'errors'
+            )
+        ]
+
+        groups = self.summary(by)
+        for key, g in sorted(
+            groups.items(), key=lambda item: -item[1]['total']
+        ):
+            lines.append(
+                '{:<24} {:>6} {:>10} {:>10} {:>10.1f} {:>10.1f} {:>6}'.format(
+                    str(key)[:24], g['calls'], g['sent'], g['received'],
+                    g['total'] * 1000, g['max'] * 1000, g['errors']
+                )
+            )
+
+        lines.append('')
+        lines.append('latency')
+        histogram = self.histogram()
+        top = max((cnt for _, cnt in histogram), default=0)
+        for bound, cnt in histogram:
+            if not cnt:
+                continue
+            label = 'inf' if bound == float('inf') else \
+                    '{:g} ms'.format(bound * 1000)
+            bar = '#' * max(1, round(40 * cnt / top))
+            lines.append('  <= {:>8} {:>6} {}'.format(label, cnt, bar))
+
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return '<Profile of {} commands>'.format(len(self.commands))
+
+
+def _payload_size(obj):
+    ''' Approximate size in bytes of <obj> sent as JSON. '''
+    if obj is None:
+        return 0
+    if isinstance(obj, str):
+        return len(obj.encode('utf-8'))
+    try:
+        return len(json.dumps(obj, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _selection_method(depth=2):
+    ''' Return the name of the outermost method of a Selection in
+        the call stack (the one called by the user) or None.
+        '''
+    from .selectq import Selection
+
+    method = None
+    frame = sys._getframe(depth)
+    while frame is not None:
+        if isinstance(frame.f_locals.get('self'), Selection):
+            method = frame.f_code.co_name
+        frame = frame.f_back
+
+    return method
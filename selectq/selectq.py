@@ -1,8 +1,11 @@
 from lxml import etree
+from selenium.common.exceptions import StaleElementReferenceException
 import contextlib, operator
 from .browsers import Browser, _browser_wrapper
 from .predicates import Value, Attr, Cond
 from .interactions import InteractionMixin
+from .xpath import Node, Raw, Step, Pred, Filter, Union
+from .xpath import BOOL, POS, predicate_kind
 '''
 >>> from selectq import FileBrowser, Selector, Attr as attr, Value as val  # byexample: +pass
 >>> browser = FileBrowser()
@@ -13,26 +16,52 @@ from .interactions import InteractionMixin
 class Selection(InteractionMixin):
     def __init__(self, browser, xpath):
         self.browser = _browser_wrapper(browser)
-        self.xpath = xpath
+
+        # the selection is a tree of nodes (see xpath.py); an xpath
+        # string is taken as is
+        if not isinstance(xpath, Node):
+            xpath = Raw(xpath)
+        self.node = xpath
+
+    @property
+    def xpath(self):
+        ''' The (optimized) xpath of the selection. '''
+        return self.node.render()
+
+    def render(self, optimize=True):
+        ''' Return the xpath of the selection.
+
+            With <optimize> in False, the xpath is the verbatim
+            concatenation of the steps of the selection (what str()
+            returns); otherwise the xpath is simplified (what is sent
+            to the browser).
+
+            >>> sel = sQ.select('li', class_='cool', id='uniq')[0]
+            >>> sel.render(optimize=False)
+            "(.//li[@class='cool'][@id='uniq'])[1]"
+
+            >>> sel.render()
+            "(.//li[@class='cool' and @id='uniq'])[1]"
+            '''
+        return self.node.render(optimize)
 
     def bind(self, browser):
-        return Selection(browser, self.xpath)
+        return Selection(browser, self.node)
 
     def pprint(self):
         self.browser.pprint(self.xpath)
 
-    def _select_xpath_for(
-        self, tag, *predicates, class_=None, for_=None, _axis=None, **attrs
+    def _step_for(
+        self, tag, *predicates, class_=None, for_=None, _axis='', **attrs
     ):
-        xpath = ''
-        if _axis:
-            xpath += _axis
-
+        ''' Return the node test and the predicates (a tuple of Pred)
+            of a step.
+            '''
+        preds = []
         if tag is not None:
             # we accept a selection instead of a tag
             if isinstance(tag, Selection):
-                # explicit "!s" conversion to ignore any parenthesis
-                tag = '{!s}'.format(tag)
+                tag = tag.node
 
             # we also "accept" a Value/Attr. Internally we say
             # that the tag is '*' and we treat the Value/Attr as another
@@ -40,16 +69,14 @@ class Selection(InteractionMixin):
             elif isinstance(tag, (Value, Attr)):
                 predicates = (tag, ) + predicates
                 tag = '*'
-
-            xpath += tag
         else:
-            xpath += '*'
+            tag = '*'
 
         if class_ is not None:
-            xpath += "[@class='{}']".format(class_)
+            preds.append(Pred("@class='{}'".format(class_), BOOL))
 
         if for_ is not None:
-            xpath += "[@for='{}']".format(for_)
+            preds.append(Pred("@for='{}'".format(for_), BOOL))
 
         for predicate in predicates:
             if not isinstance(predicate, (Selection, Value, Attr)):
@@ -57,19 +84,19 @@ class Selection(InteractionMixin):
                     "Invalid object as predicate: {}".format(repr(predicate))
                 )
 
-            # explicit "!s" conversion to ignore any parenthesis
-            xpath += "[{!s}]".format(predicate)
+            preds.append(_pred_for(predicate))
 
         for attr_name, attr_value in attrs.items():
             if attr_value is None:
-                xpath += "[@{}]".format(attr_name)
+                preds.append(Pred("@{}".format(attr_name), BOOL))
             else:
                 if isinstance(attr_value, (Value, Attr)):
-                    xpath += "[@{}={}]".format(attr_name, attr_value)
+                    pred = "@{}={}".format(attr_name, attr_value)
                 else:
-                    xpath += "[@{}='{}']".format(attr_name, attr_value)
+                    pred = "@{}='{}'".format(attr_name, attr_value)
+                preds.append(Pred(pred, BOOL))
 
-        return xpath
+        return tag, tuple(preds)
 
     def select(self, tag=None, *predicates, class_=None, for_=None, **attrs):
         ''' Select any children that have <tag> or '*' if None; from there,
@@ -88,11 +115,10 @@ class Selection(InteractionMixin):
             >>> sQ.select(for_='cool')
             sQ .//*[@for='cool']
         '''
-        xpath = self._select_xpath_for(
+        tag, preds = self._step_for(
             tag, *predicates, class_=class_, for_=for_, **attrs
         )
-        xpath = self.xpath + '//' + xpath
-        return Selection(self.browser, xpath)
+        return Selection(self.browser, Step(self.node, '//', '', tag, preds))
 
     def children(self, tag=None, *predicates, class_=None, for_=None, **attrs):
         ''' Select any direct children.
@@ -106,11 +132,10 @@ class Selection(InteractionMixin):
             >>> sQ.children('li', attr('href').endswith('.pdf'), class_='cool', id='uniq')
             sQ ./li[@class='cool'][ends-with(@href, '.pdf')][@id='uniq']
         '''
-        xpath = self._select_xpath_for(
+        tag, preds = self._step_for(
             tag, *predicates, class_=class_, for_=for_, **attrs
         )
-        xpath = self.xpath + '/' + xpath
-        return Selection(self.browser, xpath)
+        return Selection(self.browser, Step(self.node, '/', '', tag, preds))
 
     def siblings(
         self,
@@ -141,6 +166,11 @@ class Selection(InteractionMixin):
             Note: complex queries are not well supported by the browsers.
             Things like sQ.siblings('li', attr('href').endswith('.pdf'))
             may not work.
+
+            The xpath sent to the browser avoids the union when it can:
+
+            >>> sQ.select('li').siblings().xpath
+            './/*[preceding-sibling::li or following-sibling::li]'
         '''
         if direction not in ('both', 'following', 'preceding'):
             raise ValueError(
@@ -148,28 +178,22 @@ class Selection(InteractionMixin):
             )
 
         if direction in ('both', 'following'):
-            xpath = self._select_xpath_for(
-                tag,
-                *predicates,
-                class_=class_,
-                for_=for_,
-                _axis='following-sibling::',
-                **attrs
+            test, preds = self._step_for(
+                tag, *predicates, class_=class_, for_=for_, **attrs
+            )
+            s1 = Selection(
+                self.browser,
+                Step(self.node, '/', 'following-sibling::', test, preds)
             )
-            xpath = self.xpath + '/' + xpath
-            s1 = Selection(self.browser, xpath)
 
         if direction in ('both', 'preceding'):
-            xpath = self._select_xpath_for(
-                tag,
-                *predicates,
-                class_=class_,
-                for_=for_,
-                _axis='preceding-sibling::',
-                **attrs
+            test, preds = self._step_for(
+                tag, *predicates, class_=class_, for_=for_, **attrs
+            )
+            s2 = Selection(
+                self.browser,
+                Step(self.node, '/', 'preceding-sibling::', test, preds)
             )
-            xpath = self.xpath + '/' + xpath
-            s2 = Selection(self.browser, xpath)
 
         if direction == 'both':
             return (s1 | s2)
@@ -189,8 +213,8 @@ class Selection(InteractionMixin):
         return self.that(selection)
 
     def that(self, predicate):
-        xpath = self.xpath + "[{!s}]".format(predicate)
-        return Selection(self.browser, xpath)
+        pred = Filter(self.node, _pred_for(predicate), False)
+        return Selection(self.browser, pred)
 
     def _predicate_from_index(self, key):
         if isinstance(key, slice):
@@ -246,33 +270,32 @@ class Selection(InteractionMixin):
             The parameter <key> has the same semantics that any other
             indexing.
             '''
-        cond = self._predicate_from_index(key)
-        xpath = "({})[{}]".format(self.xpath, cond)
-        return Selection(self.browser, xpath)
+        cond = Pred(self._predicate_from_index(key), POS)
+        return Selection(self.browser, Filter(self.node, cond, True))
 
     def at(self, key):
         ''' Select those who are at the given position or range
             respect their parents.
             '''
-        cond = self._predicate_from_index(key)
-        xpath = "{}[{}]".format(self.xpath, cond)
-        return Selection(self.browser, xpath)
+        cond = Pred(self._predicate_from_index(key), POS)
+        return Selection(self.browser, Filter(self.node, cond, False))
 
     def query(self, what):
-        xpath = "{}/{}".format(self.xpath, what)
-        return Selection(self.browser, xpath)
+        return Selection(self.browser, Step(self.node, '/', '', what, ()))
 
     def parent(self):
-        xpath = "{}/..".format(self.xpath)
-        return Selection(self.browser, xpath)
+        return Selection(self.browser, Step(self.node, '/', '', '..', ()))
 
     def __or__(self, other):
-        xpath = "({}) | ({})".format(self.xpath, other.xpath)
-        return Selection(self.browser, xpath)
+        return Selection(self.browser, Union(self.node, other.node))
 
     def __eq__(self, cnt):
         return Cond(self, cnt, '==', operator.eq)
 
+    # == builds a condition so the selections are hashed (and found
+    # in a dict) by identity (see fill())
+    __hash__ = object.__hash__
+
     def __ne__(self, cnt):
         return Cond(self, cnt, '!=', operator.ne)
 
@@ -289,7 +312,7 @@ class Selection(InteractionMixin):
         return Cond(self, cnt, '>=', operator.ge)
 
     def __str__(self):
-        return self.xpath
+        return self.node.render(optimize=False)
 
     def __repr__(self):
         return 'sQ ' + str(self)
@@ -320,6 +343,111 @@ class Selection(InteractionMixin):
             yield self
         finally:
             self.browser.driver.switch_to.parent_frame()
+            # the snapshot, if any, is of the frame
+            self.browser.invalidate()
+
+    def materialize(self):
+        ''' Resolve the selection into Selenium WebElements once and
+            return a Materialized selection that reuses them in the
+            interactions (click(), send_keys(), clear(), switched()
+            and web_elements()) instead of querying the page each time.
+
+                form = sQ.select('form').materialize()
+                user = form.select('input', name='user').materialize()
+                user.clear().send_keys('john')
+
+            If the page replaced the elements (they are stale), they are
+            resolved again and the interaction goes on from the stale
+            element.
+            '''
+        return Materialized(self)
+
+
+class Materialized(Selection):
+    ''' A selection that holds the Selenium WebElements that it selected
+        (see Selection.materialize()).
+
+        The selections built from it (select(), ...) are not
+        materialized.
+
+        When an interaction finds a stale element, the selection is
+        resolved again and the interaction goes on from that element:
+        the elements already handled are not touched twice.
+
+        How many times the selection was resolved and how many
+        resolutions were saved reusing the WebElements are
+        reported by stats().
+        '''
+    def __init__(self, sel):
+        super().__init__(sel.browser, sel.node)
+        self.resolutions = 0
+        self.saved = 0
+        self._elements = None
+        self.resolve()
+
+    def resolve(self):
+        ''' Query the page for the WebElements again. '''
+        self._elements = self.browser.find_elements(self.xpath)
+        self.resolutions += 1
+        return self._elements
+
+    def web_elements(self):
+        if self._elements is None:
+            return self.resolve()
+
+        # the WebElements are used to interact with the page
+        # (see WebBrowser.find_elements)
+        self.browser.invalidate()
+        self.saved += 1
+        return self._elements
+
+    def stats(self):
+        return {'resolutions': self.resolutions, 'saved': self.saved}
+
+    def _each_element(self, elems, action):
+        ''' Call action(i, el) for each WebElement <el> of <elems>.
+
+            If an element is stale, resolve the selection again and go
+            on from that element: the ones before it are not touched
+            again. The selection must select as many elements as before.
+            '''
+        i = 0
+        stale_at = None
+        while i < len(elems):
+            try:
+                action(i, elems[i])
+            except StaleElementReferenceException:
+                if stale_at == i:
+                    raise  # stale even after resolving it again
+
+                if stale_at is None:
+                    # the reused elements did not save a resolution
+                    self.saved -= 1
+
+                stale_at = i
+                count = len(elems)
+                elems = self.resolve()
+                if len(elems) != count:
+                    raise Exception(
+                        'The selection changed: it selected {} elements but now it selects {}.'
+                        .format(count, len(elems))
+                    )
+                continue
+
+            i += 1
+
+    @contextlib.contextmanager
+    def switched(self):
+        with contextlib.ExitStack() as stack:
+            # only entering the frame can find a stale element and
+            # nothing was done before
+            try:
+                stack.enter_context(Selection.switched(self))
+            except StaleElementReferenceException:
+                self.saved -= 1
+                self._elements = None
+                stack.enter_context(Selection.switched(self))
+            yield self
 
 
 class Selector(Selection):
@@ -340,11 +468,31 @@ class Selector(Selection):
             >>> sQ.abs_select('li', attr('href').endswith('.pdf'), class_='cool', id='uniq')
             sQ /li[@class='cool'][ends-with(@href, '.pdf')][@id='uniq']
         '''
-        xpath = self._select_xpath_for(
+        tag, preds = self._step_for(
             tag, *predicates, class_=class_, for_=for_, **attrs
         )
-        xpath = '/' + xpath
-        return Selection(self.browser, xpath)
+        return Selection(self.browser, Step(None, '/', '', tag, preds))
 
     def pprint(self):
         print("sQ - nothing selected")
+
+
+def _pred_for(predicate):
+    ''' Return a Pred for the <predicate>: a Selection, a Value/Attr or
+        an xpath string.
+        '''
+    if isinstance(predicate, Selection):
+        node = predicate.node
+        if isinstance(node, Raw):
+            return Pred(node, predicate_kind(node.text))
+        return Pred(node, BOOL)
+
+    if isinstance(predicate, Attr):
+        return Pred(str(predicate), BOOL)
+
+    if isinstance(predicate, Value):
+        text = str(predicate)
+        return Pred(text, predicate_kind(text, predicate.require_parentesis))
+
+    text = str(predicate)
+    return Pred(text, predicate_kind(text))
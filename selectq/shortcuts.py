@@ -1,6 +1,7 @@
 from selenium import webdriver
 from selenium.webdriver import Proxy
 import time
+import warnings
 from base64 import b64decode
 
 FIREFOX_PREFERENCES = {
@@ -55,12 +56,24 @@ def open_browser(
 
         Return a Selector (sQ) object bound to the browser.
         '''
+    from .selectq import Selector
+    driver = _new_driver(browser_type, headless, proxy_conf, **browser_kargs)
+
+    sQ = Selector(driver)
+    sQ.browser.get(url)
+
+    return sQ
+
+
+def _new_driver(browser_type, headless=False, proxy_conf={}, **browser_kargs):
+    ''' Start a new WebDriver of the given <browser_type>.
+        See open_browser().
+        '''
     # make 'driver' and alias of the standard 'executable_path'
     tmp = browser_kargs.pop('driver', None)
     if tmp is not None and 'executable_path' not in browser_kargs:
         browser_kargs['executable_path'] = tmp
 
-    from .selectq import Selector
     WebDriver, Options = _browser_class_and_options(browser_type)
     if Options is None:
         warnings.warn(
@@ -78,19 +91,37 @@ def open_browser(
 
         browser_kargs['options'] = options
 
-    driver = WebDriver(**browser_kargs)
+    return WebDriver(**browser_kargs)
 
-    sQ = Selector(driver)
-    sQ.browser.get(url)
 
-    return sQ
+def wait_for(
+    *cnds,
+    mode='all',
+    step=1,
+    timeout=30,
+    take_screenshot=False,
+    observe=False
+):
+    ''' Wait for the given conditions to be true checking every <step>
+        seconds and waiting up to <timeout> seconds.
+
+        With several conditions, wait for all of them to be true
+        (<mode> 'all') or for any of them (<mode> 'any'):
 
+            wait_for(spinner == 0, table >= 1, rows >= 10)
 
-def wait_for(cnd, *, step=1, timeout=30, take_screenshot=False):
-    ''' Wait for the given condition to be true checking every <step> seconds
-        and waiting up to <timeout> seconds.
+        The counts of all the conditions are retrieved in a single
+        script on each check.
 
-        Raises TimeoutError if the condition is not met.
+        If <observe> is True, the conditions are sent to the browser once
+        and the browser notifies back as soon as they hold,
+        without polling. If the browser does not support it, the
+        conditions are polled with an increasing delay between checks
+        (up to <step> seconds).
+
+        Raises TimeoutError if the conditions are not met. The
+        conditions that are still false are listed in the message
+        and in the 'failing' attribute of the exception.
 
         If <take_screenshot> is True, a base64 encoded PNG image of the
         screen is taken on timeout and saved in the exception under
@@ -102,31 +133,56 @@ def wait_for(cnd, *, step=1, timeout=30, take_screenshot=False):
 
         '''
     from .selectq import Selection
-    if isinstance(cnd, Selection):
-        raise TypeError(
-            "Make the check explicit: 'selection != 0' for example"
-        )
-
     from .predicates import Cond
-    if not isinstance(cnd, Cond):
-        raise TypeError(
-            "Expected a condition, instead received '{}'.".format(type(cnd))
+    if not cnds:
+        raise TypeError("Expected at least one condition.")
+
+    for cnd in cnds:
+        if isinstance(cnd, Selection):
+            raise TypeError(
+                "Make the check explicit: 'selection != 0' for example"
+            )
+
+        if not isinstance(cnd, Cond):
+            raise TypeError(
+                "Expected a condition, instead received '{}'.".format(
+                    type(cnd)
+                )
+            )
+
+    if mode not in ('all', 'any'):
+        raise ValueError(
+            "Unknown mode '{}'. Expected 'all' or 'any'.".format(mode)
         )
 
-    hold = bool(cnd)
-    sleep = time.sleep
-    left = timeout
-    while not hold and left > 0:
-        sleep(step)
-        left -= step
-        hold = bool(cnd)
+    holds = all if mode == 'all' else any
+    if observe:
+        states = _observe(cnds, mode, step, timeout)
+    else:
+        states = _check(cnds, look_again=False)
+        sleep = time.sleep
+        left = timeout
+        while not holds(states) and left > 0:
+            sleep(step)
+            left -= step
+            states = _check(cnds)
+
+    if not holds(states):
+        failing = [cnd for cnd, ok in zip(cnds, states) if not ok]
+        if len(cnds) == 1:
+            msg = "{} is still false after {} secs."
+        elif mode == 'all':
+            msg = "Still false after {1} secs: {0}."
+        else:
+            msg = "None is true after {1} secs: {0}."
 
-    if not hold:
         err = TimeoutError(
-            "{} is still false after {} secs.".format(cnd, timeout)
+            msg.format(', '.join(str(cnd) for cnd in failing), timeout)
         )
+        err.failing = failing
         if take_screenshot:
-            err.screenshot = cnd.sel.browser.driver.get_screenshot_as_base64()
+            driver = cnds[0].sel.browser.driver
+            err.screenshot = driver.get_screenshot_as_base64()
             if isinstance(take_screenshot, str):
                 with open(take_screenshot, 'wb') as f:
                     f.write(b64decode(err.screenshot.encode('ascii')))
@@ -134,3 +190,56 @@ def wait_for(cnd, *, step=1, timeout=30, take_screenshot=False):
         raise err
 
     return
+
+
+def _check(cnds, look_again=True):
+    ''' Return the outcome (True or False) of each condition. The
+        counts are retrieved with a single call per browser (see
+        Browser.count_all).
+
+        If <look_again> is True, the browsers are invalidated first.
+        '''
+    by_browser = {}
+    for i, cnd in enumerate(cnds):
+        by_browser.setdefault(cnd.sel.browser, []).append(i)
+
+    states = [False] * len(cnds)
+    for browser, indexes in by_browser.items():
+        if look_again:
+            browser.invalidate()  # look at the page again
+
+        counts = browser.count_all([cnds[i].sel.xpath for i in indexes])
+        for i, cnt in zip(indexes, counts):
+            states[i] = cnds[i].op2(cnt, cnds[i].cnt)
+
+    return states
+
+
+def _observe(cnds, mode, step, timeout):
+    ''' Wait for the conditions in the browser (see Browser.wait_counts)
+        or poll them with an exponential backoff if the browser cannot
+        do it (or if it could not finish).
+        '''
+    deadline = time.monotonic() + timeout
+    browsers = {cnd.sel.browser for cnd in cnds}
+    if len(browsers) == 1:
+        browser = browsers.pop()
+        states = browser.wait_counts(
+            [(cnd.sel.xpath, cnd.sym, cnd.cnt) for cnd in cnds], mode, timeout
+        )
+        if states is not None:
+            return states
+
+    holds = all if mode == 'all' else any
+    delay = min(0.05, step)
+    states = _check(cnds, look_again=False)
+    while not holds(states):
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+
+        time.sleep(min(delay, left))
+        delay = min(delay * 2, step)
+        states = _check(cnds)
+
+    return states
@@ -0,0 +1,602 @@
+''' Selections as trees of immutable nodes.
+
+    Each method of Selection that builds a new selection (select(),
+    children(), that(), [], |, ...) adds one node on top of the tree
+    of the previous selection instead of concatenating strings.
+
+    The tree is rendered into an xpath in two ways:
+
+     - verbatim (optimize=False): the same string that the selections
+       built by concatenation, kept for str() and repr().
+     - optimized (optimize=True, the default): the tree is simplified
+       first (see Node.optimized()) and then rendered with only the
+       parenthesis that the precedence of the operators requires.
+       This is the xpath sent to the browsers.
+
+    Both mean the same:
+
+    >>> from selectq import Selector
+    >>> sQ = Selector()
+
+    The adjacent boolean predicates are merged:
+
+    >>> sel = sQ.select('li', class_='cool', id='uniq')
+    >>> str(sel)
+    ".//li[@class='cool'][@id='uniq']"
+    >>> sel.xpath
+    ".//li[@class='cool' and @id='uniq']"
+
+    The parenthesis that do not change the result are dropped and
+    the nested groups are flattened:
+
+    >>> sel = sQ.children('li')[0]
+    >>> str(sel)
+    '(./li)[1]'
+    >>> sel.xpath
+    './li[1]'
+
+    >>> sel = sQ.select('li')[0][1]
+    >>> str(sel)
+    '((.//li)[1])[2]'
+    >>> sel.xpath
+    '(.//li)[1][2]'
+
+    A '*' followed by a tag test is collapsed:
+
+    >>> sQ.select().query('self::a').xpath
+    './/a'
+
+    >>> sQ.select().that('self::a').xpath
+    './/a'
+
+    The union of the following and the preceding siblings is factored:
+
+    >>> sel = sQ.select('li').siblings('a')
+    >>> str(sel)
+    '(.//li/following-sibling::a) | (.//li/preceding-sibling::a)'
+    >>> sel.xpath
+    './/a[preceding-sibling::li or following-sibling::li]'
+
+    A step or a predicate after a union applies to the right operand
+    only (the '|' has the lowest precedence) as in the verbatim xpath;
+    index the union to filter it as a whole:
+
+    >>> sel = (sQ.select('a') | sQ.select('li')).select('span')
+    >>> str(sel)
+    '(.//a) | (.//li)//span'
+    >>> sel.xpath
+    './/a | .//li//span'
+
+    >>> sel = (sQ.select('a') | sQ.select('li')).that('@class')
+    >>> str(sel)
+    '(.//a) | (.//li)[@class]'
+    >>> sel.xpath
+    './/a | (.//li)[@class]'
+
+    The same goes for the next steps and predicates:
+
+    >>> sel = (sQ.select('a') | sQ.select('li')).select('span').select('b')
+    >>> str(sel)
+    '(.//a) | (.//li)//span//b'
+    >>> sel.xpath
+    './/a | .//li//span//b'
+
+    >>> sel = (sQ.select('a') | sQ.select('li')).select('span').parent()
+    >>> str(sel)
+    '(.//a) | (.//li)//span/..'
+    >>> sel.xpath
+    './/a | .//li//span/..'
+
+    >>> (sQ.select('a') | sQ.select('li'))[0].xpath
+    '(.//a | .//li)[1]'
+    '''
+import re
+
+_string_literal_re = re.compile(r'"[^"]*"|\'[^\']*\'')
+_position_re = re.compile(r'\b(position|last)\s*\(')
+_self_test_re = re.compile(r'^self::([A-Za-z_][\w.-]*|\*)$')
+_name_test_re = re.compile(r'^([A-Za-z_][\w.-]*|\*)$')
+
+# an xpath that is a location path (a node-set): it is true if it is
+# not empty and it is not a number so it cannot be positional
+_path_re = re.compile(
+    r'^(@?[A-Za-z_*][\w.*:-]*(\(\))?|\.\.?)(//?(@?[A-Za-z_*][\w.*:-]*(\(\))?|\.\.?))*$'
+)
+
+# functions that return a boolean or a string: as a predicate, they are
+# converted to a boolean, never to a position
+_not_numeric_functions = {
+    'starts-with', 'ends-with', 'contains', 'not', 'boolean', 'true', 'false',
+    'lang', 'normalize-space', 'translate', 'concat', 'string', 'substring',
+    'substring-before', 'substring-after', 'name', 'local-name', 'lower-case',
+    'upper-case'
+}
+_function_call_re = re.compile(r'^([A-Za-z_][\w-]*)\s*\(')
+
+
+def _top_level(text):
+    ''' Return the <text> with the string literals and the content
+        within brackets and parenthesis blanked.
+        '''
+    out = []
+    depth = 0
+    quote = None
+    for c in text:
+        if quote:
+            if c == quote:
+                quote = None
+            c = ' '
+        elif c in '"\'':
+            quote = c
+            c = ' '
+        elif c in '([':
+            depth += 1
+            c = ' '
+        elif c in ')]':
+            depth -= 1
+            c = ' '
+        elif depth > 0:
+            c = ' '
+        out.append(c)
+
+    return ''.join(out)
+
+
+def _has_top_level_or(text):
+    return re.search(r'(^|\s)or(\s|$)', _top_level(text)) is not None
+
+
+def _is_single_call(text):
+    ''' Return True if the <text> is a single function call
+        like 'contains(., "foo")'.
+        '''
+    m = _function_call_re.match(text)
+    if not m:
+        return False
+
+    depth = 0
+    for i in range(m.end() - 1, len(text)):
+        c = text[i]
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i == len(text) - 1
+
+    return False
+
+
+# The kinds of predicates:
+#  - BOOL: the predicate is a boolean that does not depend on the
+#    position of the node: it can be merged with others.
+#  - POS: the predicate is (or depends on) the position of the node.
+#  - ANY: we don't know.
+BOOL, POS, ANY = 'bool', 'pos', 'any'
+
+
+def predicate_kind(text, boolean=False):
+    ''' Guess the kind of the predicate <text> (see BOOL, POS and ANY).
+        If <boolean> is True, the predicate is known to be boolean
+        (a comparison for example).
+        '''
+    stripped = _string_literal_re.sub("''", text.strip())
+    if _position_re.search(stripped):
+        return POS
+
+    if boolean or _path_re.match(stripped):
+        return BOOL
+
+    m = _function_call_re.match(stripped)
+    if m and m.group(1) in _not_numeric_functions and _is_single_call(
+        stripped
+    ):
+        return BOOL
+
+    return ANY
+
+
+class Node:
+    ''' Base class of the nodes. The nodes are immutable and they are
+        compared and hashed by value.
+        '''
+    __slots__ = ('_cache', )
+    _fields = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self._fields, values):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_cache', {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The nodes are immutable.")
+
+    def _key(self):
+        return (type(self), ) + tuple(getattr(self, f) for f in self._fields)
+
+    def __eq__(self, other):
+        return isinstance(other, Node) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, f) for f in self._fields)
+
+    def __repr__(self):
+        return '{}({})'.format(
+            type(self).__name__,
+            ', '.join(repr(getattr(self, f)) for f in self._fields)
+        )
+
+    def render(self, optimize=True):
+        ''' Return the xpath of the tree. See the module's documentation. '''
+        try:
+            return self._cache[optimize]
+        except KeyError:
+            pass
+
+        if optimize:
+            xpath = self.optimized()._render()
+        else:
+            xpath = self._verbatim()
+
+        self._cache[optimize] = xpath
+        return xpath
+
+    def optimized(self):
+        ''' Return an equivalent tree, simplified:
+
+             - adjacent boolean predicates are merged: 'a[p][q]' becomes
+               'a[p and q]'
+             - the parenthesis that do not change the result are dropped:
+               '(./a)[1]' becomes './a[1]'
+             - a '*' followed by a tag test is collapsed: './/*[self::a]'
+               becomes './/a'
+             - the union of the following and the preceding siblings
+               is factored: '(p/following-sibling::a) | (p/preceding-sibling::a)'
+               becomes 'a[preceding-sibling::p or following-sibling::p]'
+               (within the parent of p)
+            '''
+        try:
+            return self._cache['optimized']
+        except KeyError:
+            pass
+
+        node = self._optimize()
+        self._cache['optimized'] = node
+        return node
+
+    def _optimize(self):
+        return self
+
+    def _verbatim(self):
+        raise NotImplementedError()
+
+    def _render(self):
+        raise NotImplementedError()
+
+    def _render_as_base(self):
+        ''' Render the node to be followed by a step or a predicate. '''
+        return self._render()
+
+    def _is_single(self):
+        ''' Return True if the node selects a single node (the context
+            or the root)
+            '''
+        return False
+
+
+class Raw(Node):
+    ''' An xpath given as a string. '''
+    __slots__ = _fields = ('text', )
+
+    def _verbatim(self):
+        return self.text
+
+    def _render(self):
+        return self.text
+
+    def _is_single(self):
+        return self.text in ('.', '/')
+
+
+class Pred(Node):
+    ''' A predicate: an xpath string or a node (a selection used as
+        predicate) of the given kind (see predicate_kind()).
+        '''
+    __slots__ = _fields = ('expr', 'kind')
+
+    def _verbatim(self):
+        if isinstance(self.expr, Node):
+            return self.expr.render(optimize=False)
+        return self.expr
+
+    def _render(self):
+        if isinstance(self.expr, Node):
+            return self.expr.render()
+        return self.expr
+
+
+def _merge_predicates(preds):
+    ''' Merge the adjacent boolean predicates with an 'and'. '''
+    merged = []
+    for pred in preds:
+        if pred.kind == BOOL and merged and merged[-1].kind == BOOL:
+            prev = merged[-1]
+            operands = []
+            for text in (prev._render(), pred._render()):
+                if _has_top_level_or(text):
+                    text = '({})'.format(text)
+                operands.append(text)
+
+            merged[-1] = Pred(' and '.join(operands), BOOL)
+        else:
+            merged.append(pred)
+
+    return tuple(merged)
+
+
+class Step(Node):
+    ''' A location step from the <base> node (None for the root of the
+        document): <sep> is '/' or '//', <axis> is like 'following-sibling::'
+        or '' (the child axis) and <test> is the node test (a tag
+        name, '*', '..', or a node). The predicates <preds> are a tuple
+        of Pred.
+        '''
+    __slots__ = _fields = ('base', 'sep', 'axis', 'test', 'preds')
+
+    def _verbatim(self):
+        base = '' if self.base is None else self.base.render(optimize=False)
+        test = self.test
+        if isinstance(test, Node):
+            test = test.render(optimize=False)
+
+        preds = ''.join('[{}]'.format(p._verbatim()) for p in self.preds)
+        return base + self.sep + self.axis + test + preds
+
+    def _render(self):
+        base = '' if self.base is None else self.base._render_as_base()
+        test = self.test
+        if isinstance(test, Node):
+            test = test.render()
+
+        preds = ''.join('[{}]'.format(p._render()) for p in self.preds)
+        return base + self.sep + self.axis + test + preds
+
+    def _is_forward_child_like(self):
+        ''' Return True if the positions of the nodes selected by this
+            step (over a single node) are the same than the positions
+            of the nodes in the document order.
+            '''
+        if self.sep != '/' or not self._takes_predicates():
+            return False
+
+        if self.axis == '':
+            # the test may have an axis too like in query('self::a')
+            return '::' not in self.test or \
+                self.test.startswith(('child::', 'self::', 'attribute::'))
+
+        return self.axis == 'following-sibling::'
+
+    def _takes_predicates(self):
+        ''' Return True if a predicate can be appended to the step
+            ('..[1]' is not a valid xpath for example)
+            '''
+        return isinstance(self.test, str) and self.test not in ('.', '..')
+
+    def _optimize(self):
+        test = self.test
+        if isinstance(test, Node):
+            test = test.optimized()
+        preds = tuple(p.optimized() for p in self.preds)
+
+        # '(l) | (r)//x' is 'l | r//x': the step follows the right
+        # operand only, and so do the next steps: '(l) | (r)//x/y'
+        base = _optimize_base(self.base)
+        if isinstance(base, Union):
+            right = _simplify_step(
+                base.right, self.sep, self.axis, test, preds
+            )
+            return Union(base.left, right)
+
+        return _simplify_step(base, self.sep, self.axis, test, preds)
+
+
+def _optimize_base(node):
+    ''' Return the <node> optimized to be followed by a step or
+        a predicate. A union is not factored: what follows applies
+        to its right operand only.
+        '''
+    if isinstance(node, Union):
+        return Union(node.left.optimized(), node.right.optimized())
+
+    return None if node is None else node.optimized()
+
+
+def _simplify_step(base, sep, axis, test, preds):
+    # '*[p][self::a]' is 'a[p]' if p is not positional
+    if test == '*':
+        for i, pred in enumerate(preds):
+            if pred.kind != BOOL:
+                break
+
+            m = isinstance(pred.expr, str) and \
+                _self_test_re.match(pred.expr.strip())
+            if m:
+                test, preds = m.group(1), preds[:i] + preds[i + 1:]
+                break
+
+    # 'b//*/self::a' is 'b//a'
+    if isinstance(test, str) and sep == '/' and axis == '' and \
+            isinstance(base, Step) and base.test == '*' and \
+            base.axis == '' and all(p.kind == BOOL for p in base.preds + preds):
+        m = _self_test_re.match(test.strip())
+        if m:
+            return _simplify_step(
+                base.base, base.sep, base.axis, m.group(1), base.preds + preds
+            )
+
+    return Step(base, sep, axis, test, _merge_predicates(preds))
+
+
+class Filter(Node):
+    ''' Filter the nodes selected by <base> with the predicate <pred>.
+        If <group> is True, the predicate applies to the whole node-set
+        ('(base)[pred]'), otherwise it is just appended ('base[pred]').
+        '''
+    __slots__ = _fields = ('base', 'pred', 'group')
+
+    def _verbatim(self):
+        fmt = '({})[{}]' if self.group else '{}[{}]'
+        return fmt.format(
+            self.base.render(optimize=False), self.pred._verbatim()
+        )
+
+    def _render(self):
+        # '((a)[1])[2]' is '(a)[1][2]'
+        if self.group and not (
+            isinstance(self.base, Filter) and self.base._is_filter_expr()
+        ):
+            base = '({})'.format(self.base._render())
+        else:
+            base = self.base._render_as_base()
+
+        return '{}[{}]'.format(base, self.pred._render())
+
+    def _is_filter_expr(self):
+        ''' Return True if the node is rendered as '(...)[...]' '''
+        if self.group:
+            return True
+
+        base = self.base
+        return isinstance(base, Union) or \
+            (isinstance(base, Filter) and base._is_filter_expr())
+
+    def _optimize(self):
+        # '(l) | (r)[p]' filters the right operand only
+        if not self.group and isinstance(self.base, Union):
+            return Union(
+                self.base.left.optimized(),
+                Filter(self.base.right, self.pred, True).optimized()
+            )
+
+        step = _as_step(self.base)
+        if step is not None:
+            # 'a[p]' and '(./a)[p]' are the same: append the predicate
+            # to the step (before optimizing the step: the optimization
+            # may change what position() counts)
+            single = step.base is None or step.base._is_single()
+            if not self.group or (single and step._is_forward_child_like()):
+                step = Step(
+                    step.base, step.sep, step.axis, step.test,
+                    step.preds + (self.pred, )
+                )
+                return step.optimized()
+
+        pred = self.pred.optimized()
+        if self.group:
+            return Filter(self.base.optimized(), pred, True)
+
+        # '(l) | (r)/..[p]' filters the last step of the right operand
+        base = _optimize_base(self.base)
+        if isinstance(base, Union):
+            return Union(base.left, Filter(base.right, pred, False))
+
+        return Filter(base, pred, False)
+
+
+def _as_step(node):
+    ''' Return the Step equivalent to the <node> if the node is a step
+        or a step with predicates appended (not grouped), None otherwise.
+        '''
+    if isinstance(node, Step):
+        return node if node._takes_predicates() else None
+
+    if isinstance(node, Filter) and not node.group:
+        step = _as_step(node.base)
+        if step is not None:
+            return Step(
+                step.base, step.sep, step.axis, step.test,
+                step.preds + (node.pred, )
+            )
+
+    return None
+
+
+class Union(Node):
+    ''' The union of the nodes selected by <left> and <right>. '''
+    __slots__ = _fields = ('left', 'right')
+
+    def _verbatim(self):
+        return '({}) | ({})'.format(
+            self.left.render(optimize=False),
+            self.right.render(optimize=False)
+        )
+
+    def _render(self):
+        operands = []
+        for node in (self.left, self.right):
+            if isinstance(node, Raw):
+                operands.append('({})'.format(node._render()))
+            else:
+                operands.append(node._render())
+
+        return ' | '.join(operands)
+
+    def _render_as_base(self):
+        return '({})'.format(self._render())
+
+    def _optimize(self):
+        left = self.left.optimized()
+        right = self.right.optimized()
+
+        factored = _factor_siblings(left, right)
+        if factored is not None:
+            return factored
+
+        return Union(left, right)
+
+
+def _factor_siblings(left, right):
+    ''' Rewrite 'b/s/following-sibling::x | b/s/preceding-sibling::x'
+        as 'b/x[preceding-sibling::s or following-sibling::s]': both
+        select the x nodes that have a s node as sibling.
+
+        Return None if the union is not like that.
+        '''
+    if not (isinstance(left, Step) and isinstance(right, Step)):
+        return None
+
+    axes = {left.axis, right.axis}
+    if axes != {'following-sibling::', 'preceding-sibling::'}:
+        return None
+
+    if left.sep != '/' or right.sep != '/' or left.base != right.base or \
+            left.test != right.test or left.preds != right.preds:
+        return None
+
+    # positional predicates count the nodes along the sibling axis
+    if not all(p.kind == BOOL for p in left.preds):
+        return None
+
+    if not isinstance(left.test, str) or not _name_test_re.match(left.test):
+        return None
+
+    s = left.base
+    if not isinstance(s, Step) or s.axis != '' or \
+            not isinstance(s.test, str) or not _name_test_re.match(s.test):
+        return None
+
+    # the step s will be evaluated from its siblings instead of from
+    # its parent: a positional predicate would change its meaning
+    if not all(p.kind == BOOL for p in s.preds):
+        return None
+
+    s_step = s.test + ''.join('[{}]'.format(p._render()) for p in s.preds)
+    sibling_pred = Pred(
+        'preceding-sibling::{0} or following-sibling::{0}'.format(s_step), BOOL
+    )
+    return _simplify_step(
+        s.base, s.sep, '', left.test, left.preds + (sibling_pred, )
+    )